@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+
+import config
+import metrics
+from writebehind import WriteBehindBuffer
+
+
+class UserFloodState:
+    """Ведро токенов и текущее окно сообщений одного пользователя"""
+
+    __slots__ = ("tokens", "updated", "window_started", "texts", "warned_at")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.window_started = 0.0
+        # Сообщения текущего окна, которые еще не переданы в буфер записи
+        self.texts: List[str] = []
+        self.warned_at = 0.0
+
+
+class FloodControl:
+    """Ограничение частоты и объединение сообщений пользователей
+
+    У каждого пользователя ведро на burst сообщений, которое пополняется
+    со скоростью rate сообщений в секунду; сообщения сверх него отбрасываются.
+    Сообщения, пришедшие за window секунд с первого, сохраняются одним
+    UserMessage, а подтверждение отправляется только на первое из них.
+    Состояние хранится для max_users последних пользователей (LRU);
+    пользователи с полным ведром и без открытого окна удаляются сразу.
+    """
+
+    def __init__(
+        self,
+        buffer: WriteBehindBuffer,
+        rate: float = config.FLOOD_RATE,
+        burst: int = config.FLOOD_BURST,
+        window: float = config.FLOOD_WINDOW,
+        max_users: int = config.FLOOD_CACHE_SIZE
+    ):
+        self.buffer = buffer
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.max_users = max_users
+        # Порядок - по последнему сообщению: в начале самые давние
+        self._users: "OrderedDict[int, UserFloodState]" = OrderedDict()
+        # Сроки закрытия окон в порядке открытия: (срок, Telegram ID, начало окна)
+        self._deadlines: Deque[Tuple[float, int, float]] = deque()
+        self._task: Optional[asyncio.Task] = None
+
+    def _get_state(self, user_id: int, now: float) -> UserFloodState:
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = UserFloodState(self.burst, now)
+        self._users.move_to_end(user_id)
+        return state
+
+    def allow(self, user_id: int) -> bool:
+        """Списание токена за сообщение; False - лимит исчерпан"""
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        state = self._get_state(user_id, now)
+        state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        if state.tokens >= 1:
+            state.tokens -= 1
+            return True
+        metrics.THROTTLED_MESSAGES.inc()
+        return False
+
+    def should_warn(self, user_id: int) -> bool:
+        """Предупреждать о превышении лимита не чаще раза за окно"""
+        now = time.monotonic()
+        state = self._get_state(user_id, now)
+        if now - state.warned_at < (self.window or 1 / self.rate):
+            return False
+        state.warned_at = now
+        return True
+
+    async def add_message(self, user_id: int, message_text: str) -> bool:
+        """Сообщение пользователя; True - первое в окне, на него нужно ответить"""
+        if not self.window:
+            await self.buffer.add_message(user_id, message_text)
+            return True
+        now = time.monotonic()
+        state = self._get_state(user_id, now)
+        if state.texts and now - state.window_started < self.window:
+            state.texts.append(message_text)
+            metrics.COALESCED_MESSAGES.inc()
+            return False
+        # Окно могло истечь, но еще не быть закрыто фоновой задачей.
+        # Новое окно открывается до записи старого, чтобы сообщение,
+        # пришедшее во время записи, попало в новое окно
+        expired = state.texts
+        state.window_started = now
+        state.texts = [message_text]
+        self._deadlines.append((now + self.window, user_id, now))
+        if expired:
+            await self.buffer.add_message(user_id, "\n".join(expired))
+        await self._evict()
+        return True
+
+    async def _emit(self, user_id: int, state: UserFloodState) -> None:
+        texts, state.texts = state.texts, []
+        await self.buffer.add_message(user_id, "\n".join(texts))
+
+    async def _evict(self) -> None:
+        while len(self._users) > self.max_users:
+            user_id, state = self._users.popitem(last=False)
+            if state.texts:
+                await self._emit(user_id, state)
+
+    async def sweep(self) -> None:
+        """Закрытие истекших окон и удаление простаивающих пользователей"""
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, user_id, window_started = self._deadlines.popleft()
+            state = self._users.get(user_id)
+            # Окно могло быть уже закрыто новым сообщением или вытеснением
+            if state and state.texts and state.window_started == window_started:
+                await self._emit(user_id, state)
+        # Ведро пополняется до полного за burst / rate секунд
+        idle = self.burst / self.rate if self.rate else 0
+        while self._users:
+            user_id, state = next(iter(self._users.items()))
+            if state.texts or now - state.updated < idle or now - state.window_started < self.window:
+                break
+            del self._users[user_id]
+
+    async def _run(self) -> None:
+        interval = min(self.window, 1.0) if self.window else 1.0
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logging.exception(f"Ошибка при закрытии окон сообщений: {e}")
+
+    async def start(self) -> None:
+        """Запуск фонового закрытия окон"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Остановка и передача незакрытых окон в буфер записи"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for user_id, state in list(self._users.items()):
+            if state.texts:
+                await self._emit(user_id, state)
+        self._deadlines.clear()
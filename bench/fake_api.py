@@ -0,0 +1,188 @@
+"""Локальная замена Telegram Bot API для нагрузочных проверок
+
+Сервер принимает запросы вида /bot<token>/<method> и отвечает как Telegram.
+Можно задать задержку ответа, глобальный лимит скорости (сверх него - 429
+с retry_after), долю случайных 429 и долю пользователей, заблокировавших бота
+(403). Отдельно запускается так:
+
+    python -m bench.fake_api --port 8081 --latency 50 --rate 30 --blocked 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+# Методы, которые возвращают объект Message
+MESSAGE_METHODS = {
+    "sendMessage",
+    "sendPhoto",
+    "sendVideo",
+    "sendDocument",
+    "editMessageText"
+}
+
+
+class FakeBotAPI:
+    """Сервер, имитирующий ответы и ограничения Bot API"""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate: float = 0.0,
+        flood_ratio: float = 0.0,
+        blocked_ratio: float = 0.0,
+        retry_after: int = 1,
+        seed: int = 0
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.flood_ratio = flood_ratio
+        self.blocked_ratio = blocked_ratio
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._recent = deque()
+        self._message_id = 0
+        self.calls = Counter()
+        self.responses = Counter()
+        self._runner: Optional[web.AppRunner] = None
+
+    def is_blocked(self, chat_id: int) -> bool:
+        """Заблокировал ли пользователь бота (детерминированно по ID чата)"""
+        return (chat_id * 2654435761) % 10000 < self.blocked_ratio * 10000
+
+    def _over_rate(self) -> bool:
+        if not self.rate:
+            return False
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= 1:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate:
+            return True
+        self._recent.append(now)
+        return False
+
+    def _error(self, code: int, description: str, **parameters: Any) -> web.Response:
+        self.responses[code] += 1
+        body: Dict[str, Any] = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        # aiogram выбирает тип исключения по HTTP-статусу, как у Telegram
+        return web.json_response(body, status=code)
+
+    def _ok(self, result: Any) -> web.Response:
+        self.responses[200] += 1
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._random.random() * self.jitter)
+
+        chat_id = int(params.get("chat_id") or 0)
+        if method in MESSAGE_METHODS or method in ("copyMessage", "copyMessages"):
+            if self._over_rate() or self._random.random() < self.flood_ratio:
+                return self._error(
+                    429,
+                    f"Too Many Requests: retry after {self.retry_after}",
+                    retry_after=self.retry_after
+                )
+            if chat_id and self.is_blocked(chat_id):
+                return self._error(403, "Forbidden: bot was blocked by the user")
+
+        self._message_id += 1
+        if method == "copyMessage":
+            return self._ok({"message_id": self._message_id})
+        if method == "copyMessages":
+            copied = []
+            for _ in json.loads(params["message_ids"]):
+                copied.append({"message_id": self._message_id})
+                self._message_id += 1
+            return self._ok(copied)
+        if method in MESSAGE_METHODS:
+            return self._ok({
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", "")
+            })
+        if method == "getMe":
+            return self._ok({"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"})
+        return self._ok(True)
+
+    def create_app(self) -> web.Application:
+        """aiohttp-приложение сервера"""
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> str:
+        """Запуск сервера; возвращает базовый адрес для TelegramAPIServer.from_base"""
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        """Остановка сервера"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset(self) -> None:
+        """Сброс счетчиков между сценариями"""
+        self.calls.clear()
+        self.responses.clear()
+        self._recent.clear()
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Параметры поведения сервера"""
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="сообщений в секунду до ответа 429 (0 - без ограничения)")
+    parser.add_argument("--flood", type=float, default=0.0, help="доля случайных ответов 429")
+    parser.add_argument("--blocked", type=float, default=0.0, help="доля пользователей, заблокировавших бота")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, секунд")
+
+
+def from_arguments(args: argparse.Namespace) -> FakeBotAPI:
+    """Создание сервера по параметрам командной строки"""
+    return FakeBotAPI(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        rate=args.rate,
+        flood_ratio=args.flood,
+        blocked_ratio=args.blocked,
+        retry_after=args.retry_after
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    api = from_arguments(args)
+    url = await api.start(args.host, args.port)
+    print(f"Bot API слушает {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
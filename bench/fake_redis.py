@@ -0,0 +1,139 @@
+"""Локальная замена клиента Redis для проверки хранилища состояний
+
+FakeRedis реализует команды, которые использует RedisStateStore (get, set
+с px, delete), и хранит значения в памяти процесса. Время берется из clock,
+поэтому истечение TTL проверяется без ожидания. Проверка хранилища:
+
+    python -m bench.fake_redis
+    python -m bench.fake_redis --url redis://localhost:6379/15   # на настоящем сервере
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeRedis:
+    """Асинхронный клиент Redis в памяти с истечением ключей"""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        # Ключ -> (значение, время истечения или None)
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+
+    def _alive(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= self.clock():
+            del self._data[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._alive(key)
+
+    async def set(self, key: str, value, px: Optional[int] = None) -> bool:
+        if isinstance(value, str):
+            value = value.encode()
+        self._data[key] = (value, self.clock() + px / 1000 if px else None)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    async def aclose(self) -> None:
+        self._data.clear()
+
+
+class ManualClock:
+    """Часы, которые идут только по команде"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+async def check_state_store(client, advance: Callable[[float], object]) -> None:
+    """Проверка RedisStateStore и FSM-хранилища поверх него
+
+    advance(seconds) должен сдвигать время клиента (для FakeRedis) или ждать.
+    При ошибке - AssertionError.
+    """
+    from aiogram.fsm.storage.base import StorageKey
+    from states import AdminStates, RedisStateStore, StateStoreStorage
+
+    store = RedisStateStore(client=client, prefix="tgbot-check:")
+
+    # get/set/delete
+    assert await store.get("missing") is None
+    await store.set("plain", {"a": 1})
+    assert await store.get("plain") == {"a": 1}
+    await store.delete("plain")
+    assert await store.get("plain") is None
+
+    # Истечение TTL
+    await store.set("short", {"b": 2}, ttl=1)
+    assert await store.get("short") == {"b": 2}
+    await advance(1.2)
+    assert await store.get("short") is None
+
+    # Состояние и данные FSM - разные ключи
+    storage = StateStoreStorage(store, ttl=60)
+    key = StorageKey(bot_id=1, chat_id=10, user_id=10)
+    await storage.set_state(key, AdminStates.waiting_for_reply)
+    await storage.set_data(key, {"user_id": 5})
+    assert await storage.get_state(key) == AdminStates.waiting_for_reply.state
+    assert await storage.get_data(key) == {"user_id": 5}
+    assert await client.get("tgbot-check:" + storage._key(key, "state")) is not None
+    assert await client.get("tgbot-check:" + storage._key(key, "data")) is not None
+    # Сброс состояния не трогает данные и наоборот
+    await storage.set_state(key, None)
+    assert await storage.get_state(key) is None
+    assert await storage.get_data(key) == {"user_id": 5}
+    await storage.set_state(key, AdminStates.waiting_for_broadcast)
+    await storage.set_data(key, {})
+    assert await storage.get_state(key) == AdminStates.waiting_for_broadcast.state
+    assert await storage.get_data(key) == {}
+    # Ключи другого бота не пересекаются
+    other = StorageKey(bot_id=2, chat_id=10, user_id=10)
+    assert await storage.get_state(other) is None
+    await storage.set_state(key, None)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Проверка хранилища состояний Redis")
+    parser.add_argument("--url", help="адрес настоящего сервера Redis (по умолчанию - FakeRedis)")
+    args = parser.parse_args()
+    sys.path.insert(0, PACKAGE_DIR)
+
+    if args.url:
+        from redis import asyncio as aioredis
+        client = aioredis.from_url(args.url)
+        advance = asyncio.sleep
+    else:
+        clock = ManualClock()
+        client = FakeRedis(clock)
+
+        async def advance(seconds: float) -> None:
+            clock.advance(seconds)
+
+    try:
+        await check_state_store(client, advance)
+    finally:
+        await client.aclose()
+    print("Хранилище состояний Redis: проверки пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""Проверка ограничителей рассылки (broadcaster.py)
+
+Проверяется, что после паузы по ответу 429 ведро токенов не выдает пачку
+запросов, а отправка одному получателю не ждет 429 бесконечно:
+
+    python -m bench.limits
+"""
+import asyncio
+import os
+import sys
+import time
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def check_pause_no_burst(rate: float = 10, pause: float = 1.0, window: float = 0.3) -> None:
+    """После pause() за window секунд выдается не больше ~rate * window токенов"""
+    from broadcaster import TokenBucket
+
+    bucket = TokenBucket(rate)
+    bucket.pause(pause)
+    await asyncio.sleep(pause)
+    granted = 0
+    deadline = time.monotonic() + window
+
+    async def take() -> None:
+        nonlocal granted
+        while True:
+            await bucket.acquire()
+            if time.monotonic() > deadline:
+                return
+            granted += 1
+
+    await take()
+    # Первый токен накапливается 1 / rate секунд, плюс запас на неточность таймеров
+    assert granted <= rate * window + 1, f"после паузы выдано {granted} токенов за {window} с"
+
+
+async def check_flood_limit() -> None:
+    """Получатель, на которого постоянно приходит 429, пропускается с причиной flood"""
+    from aiogram.exceptions import TelegramRetryAfter
+    from aiogram.methods import SendMessage
+    from broadcaster import Broadcaster, ChatRateLimiter, TokenBucket
+
+    broadcaster = Broadcaster(TokenBucket(1000), ChatRateLimiter(1000), max_flood_retries=3)
+    calls = 0
+
+    async def flood(chat_id: int) -> None:
+        nonlocal calls
+        calls += 1
+        raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text="x"), "Too Many Requests", 0)
+
+    assert await broadcaster.deliver(1, flood) == "flood"
+    assert calls == 4, f"отправок {calls}, ожидалось 4"
+
+    # max_retries=0 - одна попытка, а не значение по умолчанию
+    calls = 0
+
+    async def failing(chat_id: int) -> None:
+        nonlocal calls
+        calls += 1
+        raise OSError("network")
+
+    assert await broadcaster.deliver(1, failing, max_retries=0) == "network"
+    assert calls == 1, f"попыток {calls}, ожидалась 1"
+
+
+async def main() -> None:
+    sys.path.insert(0, PACKAGE_DIR)
+    await check_pause_no_burst()
+    await check_flood_limit()
+    print("Ограничители рассылки: проверки пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+"""Заполнение базы бота синтетическими данными
+
+Создает bot_database.db в указанном каталоге: пользователей, сообщения
+(часть прочитана, по одному диалогу на пользователя) и историю рассылок
+с дневными сводками:
+
+    python -m bench.seed --workdir /tmp/bench --users 100000 --messages 50000 --broadcasts 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Первый Telegram ID синтетических пользователей
+FIRST_USER_ID = 10_000_000
+# Размер пакета вставки
+CHUNK_SIZE = 5000
+
+
+async def _insert(session, model, rows: List[Dict[str, Any]]) -> None:
+    from sqlalchemy import insert
+    for start in range(0, len(rows), CHUNK_SIZE):
+        await session.execute(insert(model), rows[start:start + CHUNK_SIZE])
+
+
+async def seed(
+    users: int,
+    messages: int = 0,
+    broadcasts: int = 0,
+    read_ratio: float = 0.5,
+    days: int = 60,
+    seed_value: int = 0
+) -> Dict[str, Any]:
+    """Заполнение пустой базы в текущем каталоге; возвращает объемы и время"""
+    sys.path.insert(0, PACKAGE_DIR)
+    from sqlalchemy import func, select
+    from database import Broadcast, BroadcastDailyStats, User, UserMessage, async_session
+    from migrations import run_migrations
+
+    rnd = random.Random(seed_value)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    await run_migrations()
+
+    async with async_session() as session:
+        if await session.scalar(select(func.count()).select_from(User)):
+            raise RuntimeError("База уже содержит пользователей - укажите пустой каталог")
+
+        await _insert(session, User, [
+            {
+                "id": i + 1,
+                "user_id": FIRST_USER_ID + i,
+                "username": f"user{i}",
+                "first_name": f"User{i}",
+                "is_active": True,
+                "created_at": now - timedelta(days=days),
+                "last_seen": now - timedelta(days=rnd.random() * days)
+            }
+            for i in range(users)
+        ])
+
+        # Сообщение i принадлежит пользователю i % users; первые сообщения
+        # пользователей получают ID 1..users и начинают их диалоги
+        if users:
+            await _insert(session, UserMessage, [
+                {
+                    "id": i + 1,
+                    "user_id": i % users + 1,
+                    "thread_id": i % users + 1,
+                    "message_text": f"Сообщение {i}",
+                    "is_admin": False,
+                    "is_read": rnd.random() < read_ratio,
+                    "created_at": now - timedelta(seconds=(messages - i) * 10)
+                }
+                for i in range(messages)
+            ])
+
+        rollups = defaultdict(lambda: {"broadcasts": 0, "sent": 0, "failed": 0, "duration_seconds": 0.0})
+        rows = []
+        for i in range(broadcasts):
+            created_at = now - timedelta(days=days * (broadcasts - i) / broadcasts)
+            failed = int(users * rnd.uniform(0.01, 0.1))
+            duration = users / 28
+            rows.append({
+                "id": i + 1,
+                "message_text": f"Рассылка {i}",
+                "status": "completed",
+                "last_user_id": users,
+                "sent_count": users - failed,
+                "failed_count": failed,
+                "failure_reasons": {"blocked": failed},
+                "created_at": created_at,
+                "completed_at": created_at + timedelta(seconds=duration)
+            })
+            rollup = rollups[created_at.date()]
+            rollup["broadcasts"] += 1
+            rollup["sent"] += users - failed
+            rollup["failed"] += failed
+            rollup["duration_seconds"] += duration
+        await _insert(session, Broadcast, rows)
+        await _insert(session, BroadcastDailyStats, [
+            {"day": day, **values} for day, values in rollups.items()
+        ])
+        await session.commit()
+
+    return {
+        "users": users,
+        "messages": messages,
+        "broadcasts": broadcasts,
+        "seconds": time.perf_counter() - started
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Объемы синтетических данных"""
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--broadcasts", type=int, default=100)
+    parser.add_argument("--read-ratio", type=float, default=0.5, help="доля прочитанных сообщений")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Заполнение базы бота синтетическими данными")
+    parser.add_argument("--workdir", required=True, help="каталог, в котором создается bot_database.db")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    result = await seed(args.users, args.messages, args.broadcasts, args.read_ratio)
+    print(f"Создано: {result['users']} пользователей, {result['messages']} сообщений, "
+          f"{result['broadcasts']} рассылок за {result['seconds']:.1f} с")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
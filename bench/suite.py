@@ -0,0 +1,237 @@
+"""Набор нагрузочных сценариев без обращения к Telegram
+
+База заполняется синтетическими данными (см. bench/seed.py), а бот работает
+с локальной заменой Bot API (см. bench/fake_api.py). Сценарии:
+
+- broadcast - рассылка всем пользователям базы;
+- inbound - обработка входящих сообщений пользователей;
+- messages - задержка команды /messages;
+- stats - задержка команды /stats.
+
+Для каждого сценария измеряются время и память, результат выводится в JSON.
+С --output результат дописывается строкой в JSONL-файл, чтобы сравнивать версии:
+
+    python -m bench.suite --users 20000 --messages 10000 --latency 30 --blocked 0.05 --output bench.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List
+
+from bench import fake_api, seed
+from bench.webhook_load import make_update, percentile
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["broadcast", "inbound", "messages", "stats"]
+# Telegram ID администратора в сценариях
+ADMIN_ID = 1
+
+
+def git_version() -> str:
+    """Версия кода, на которой запущены сценарии"""
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=PACKAGE_DIR,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def max_rss_mb() -> float:
+    """Пиковый объем памяти процесса (МБ)"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss - килобайты в Linux и байты в macOS
+    return rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Сводка задержек в миллисекундах"""
+    return {
+        "mean": statistics.fmean(latencies) if latencies else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99)
+    }
+
+
+async def measure(scenario: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Запуск сценария с замером времени и памяти"""
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    result = await scenario()
+    result["seconds"] = time.perf_counter() - started
+    if tracemalloc.is_tracing():
+        result["python_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    result["max_rss_mb"] = max_rss_mb()
+    return result
+
+
+async def run_suite(args: argparse.Namespace) -> Dict[str, Any]:
+    # Настройки бота читаются при импорте - окружение готовится заранее
+    os.environ["BOT_TOKEN"] = "123456:bench"
+    os.environ["ADMIN_ID"] = str(ADMIN_ID)
+    os.environ["STATE_BACKEND"] = "memory"
+    os.environ["BROADCAST_RATE"] = str(args.broadcast_rate)
+    sys.path.insert(0, PACKAGE_DIR)
+
+    seeded = await seed.seed(args.users, args.messages, args.broadcasts, args.read_ratio)
+
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import Message, Update
+    import bot as bot_module
+    from database import async_session
+    from utils import broadcast_message
+
+    api = fake_api.from_arguments(args)
+    base_url = await api.start(port=args.api_port)
+    bot = Bot(
+        token=os.environ["BOT_TOKEN"],
+        session=AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    )
+    dp = bot_module.dp
+    update_ids = iter(range(1, 10 ** 9))
+
+    async def feed(user_id: int, text: str) -> None:
+        update = Update.model_validate(make_update(next(update_ids), user_id, text))
+        await dp.feed_update(bot, update)
+
+    async def timed_command(text: str) -> Dict[str, Any]:
+        latencies = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            await feed(ADMIN_ID, text)
+            latencies.append((time.perf_counter() - started) * 1000)
+        return {"requests": args.repeat, "latency_ms": latency_summary(latencies)}
+
+    async def broadcast() -> Dict[str, Any]:
+        message = Message.model_validate({
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": ADMIN_ID, "type": "private"},
+            "from": {"id": ADMIN_ID, "is_bot": False, "first_name": "Admin"},
+            "text": "Синтетическая рассылка"
+        })
+        started = time.perf_counter()
+        async with async_session() as session:
+            stats = await broadcast_message(bot, message, session)
+        seconds = time.perf_counter() - started
+        return {
+            **stats,
+            "messages_per_sec": stats["total"] / seconds if seconds else 0.0,
+            "api_calls": sum(api.calls.values()),
+            "responses": {str(code): count for code, count in api.responses.items()}
+        }
+
+    async def inbound() -> Dict[str, Any]:
+        semaphore = asyncio.Semaphore(args.concurrency)
+        # Пишут боту только те, кто его не заблокировал
+        senders = [
+            seed.FIRST_USER_ID + i
+            for i in range(args.users)
+            if not api.is_blocked(seed.FIRST_USER_ID + i)
+        ]
+        errors = 0
+
+        async def handle(i: int) -> None:
+            nonlocal errors
+            async with semaphore:
+                try:
+                    await feed(senders[i % len(senders)], f"Входящее {i}")
+                except Exception:
+                    errors += 1
+
+        await dp.emit_startup(bot=bot)
+        started = time.perf_counter()
+        await asyncio.gather(*(handle(i) for i in range(args.inbound)))
+        # Обновление считается обработанным, когда оно записано в базу
+        await dp.emit_shutdown(bot=bot)
+        seconds = time.perf_counter() - started
+        return {
+            "updates": args.inbound,
+            "errors": errors,
+            "concurrency": args.concurrency,
+            "updates_per_sec": args.inbound / seconds if seconds else 0.0
+        }
+
+    scenarios = {
+        "broadcast": broadcast,
+        "inbound": inbound,
+        "messages": lambda: timed_command("/messages"),
+        "stats": lambda: timed_command("/stats")
+    }
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    results = {}
+    try:
+        for name in args.scenarios:
+            api.reset()
+            results[name] = await measure(scenarios[name])
+    finally:
+        tracemalloc.stop()
+        await bot.session.close()
+        await api.stop()
+
+    return {
+        "version": git_version(),
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": {key: value for key, value in vars(args).items() if key not in ("workdir", "output")},
+        "seed": seeded,
+        "scenarios": results
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочные сценарии с локальной заменой Bot API")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=SCENARIOS,
+                        help=f"сценарии через запятую: {','.join(SCENARIOS)}")
+    parser.add_argument("--workdir", help="каталог для базы данных (по умолчанию временный)")
+    parser.add_argument("--output", help="JSONL-файл, в который дописывается результат")
+    seed.add_arguments(parser)
+    fake_api.add_arguments(parser)
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--broadcast-rate", type=float, default=1000,
+                        help="BROADCAST_RATE бота на время проверки, сообщений в секунду")
+    parser.add_argument("--inbound", type=int, default=5000, help="входящих сообщений в сценарии inbound")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременно обрабатываемых обновлений")
+    parser.add_argument("--repeat", type=int, default=50, help="повторов команд /messages и /stats")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="замерять пиковую память Python по сценариям (замедляет работу)")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    # Путь к output запоминаем до смены каталога
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="tgbot-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    result = await run_suite(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if output:
+        with open(output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,189 @@
+"""Нагрузочная проверка вебхука синтетическими обновлениями
+
+По умолчанию бот запускается в этом же процессе во временном каталоге
+(отдельная база), а запросы к Bot API подменяются заглушкой, поэтому
+Telegram не нужен:
+
+    python -m bench.webhook_load --users 200 --messages 5000 --concurrency 100
+
+Можно нагрузить уже запущенный бот по адресу его вебхука:
+
+    python -m bench.webhook_load --url http://127.0.0.1:8080/webhook --secret SECRET
+
+Результат выводится в формате JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+import aiohttp
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """Синтетическое обновление с сообщением из личного чата"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "text": text
+        }
+    }
+
+
+def make_updates(users: int, messages: int, first_user_id: int = 10_000_000) -> List[Dict[str, Any]]:
+    """Сначала /start от каждого пользователя, затем обычные сообщения"""
+    updates = [
+        make_update(i + 1, first_user_id + i, "/start")
+        for i in range(users)
+    ]
+    for i in range(messages):
+        update_id = users + i + 1
+        updates.append(make_update(update_id, first_user_id + i % users, f"Сообщение {i}"))
+    return updates
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль списка значений"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def post_updates(
+    url: str,
+    updates: List[Dict[str, Any]],
+    concurrency: int,
+    secret: Optional[str]
+) -> Dict[str, Any]:
+    """Отправка обновлений на вебхук и сбор задержек ответа"""
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal errors
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return {
+        "seconds": time.perf_counter() - started,
+        "errors": errors,
+        "ack_latency_ms": {
+            "mean": statistics.fmean(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99)
+        }
+    }
+
+
+async def run_in_process(args: argparse.Namespace, updates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Запуск бота в процессе с заглушкой Bot API и нагрузка его вебхука"""
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    os.environ.setdefault("ADMIN_ID", "1")
+    os.environ["WEBHOOK_SECRET"] = args.secret or ""
+    sys.path.insert(0, PACKAGE_DIR)
+
+    # Импорт после подготовки окружения: бот читает настройки при импорте
+    from aiogram.client.session.base import BaseSession
+    from aiohttp import web
+    import bot as bot_module
+    from migrations import run_migrations
+    from webhook import create_webhook_app
+
+    class StubSession(BaseSession):
+        """Сессия, которая не обращается к Telegram и сразу возвращает успех"""
+
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536,
+                                 raise_for_status=True) -> AsyncGenerator[bytes, None]:
+            yield b""
+
+        async def close(self):
+            pass
+
+    stub = StubSession()
+    bot_module.bot.session = stub
+    await run_migrations()
+
+    app = create_webhook_app(bot_module.dp, {"": bot_module.bot}, concurrency=args.handler_concurrency)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    url = f"http://127.0.0.1:{args.port}{os.getenv('WEBHOOK_PATH', '/webhook')}"
+
+    started = time.perf_counter()
+    result = await post_updates(url, updates, args.concurrency, args.secret)
+    # Ответ приходит до обработки - ждем, пока обработчики закончат
+    await runner.cleanup()
+    result["handled_seconds"] = time.perf_counter() - started
+    result["updates_per_sec"] = len(updates) / result["handled_seconds"]
+    result["api_calls"] = stub.calls
+    return result
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка вебхука")
+    parser.add_argument("--url", help="адрес вебхука запущенного бота")
+    parser.add_argument("--secret", default="bench-secret", help="секрет вебхука")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных HTTP-запросов")
+    parser.add_argument("--handler-concurrency", type=int, default=50,
+                        help="одновременно обрабатываемых обновлений (в процессе)")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--workdir", help="каталог для базы данных бота (по умолчанию временный)")
+    args = parser.parse_args()
+
+    updates = make_updates(args.users, args.messages)
+    if args.url:
+        result = await post_updates(args.url, updates, args.concurrency, args.secret)
+        result["updates_per_sec"] = len(updates) / result["seconds"]
+    else:
+        workdir = args.workdir or tempfile.mkdtemp(prefix="tgbot-bench-")
+        os.makedirs(workdir, exist_ok=True)
+        os.chdir(workdir)
+        result = await run_in_process(args, updates)
+
+    result.update({
+        "mode": "url" if args.url else "in_process",
+        "updates": len(updates),
+        "concurrency": args.concurrency
+    })
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
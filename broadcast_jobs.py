@@ -0,0 +1,261 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import config
+from broadcaster import BroadcastAborted, BroadcastControl, Broadcaster, SendFunc
+from database import Broadcast
+from utils import format_duration, run_broadcast, set_broadcast_status
+
+# Заголовки сообщения о ходе рассылки по состояниям задачи
+JOB_STATUS_LABELS = {
+    "queued": "⏳ в очереди",
+    "running": "📤 выполняется",
+    "paused": "⏸ на паузе",
+    "completed": "✅ завершена",
+    "cancelled": "✖️ отменена",
+    "interrupted": "⏹ прервана остановкой бота (продолжить: /resume)",
+    "failed": "❌ остановлена из-за ошибки"
+}
+
+
+class BroadcastJob:
+    """Рассылка, которая выполняется в фоне
+
+    Задача хранит фабрику сессий базы своего бота и его broadcaster:
+    рассылка пишет в базу бота и соблюдает лимиты его токена.
+    """
+
+    def __init__(
+        self,
+        broadcast_id: int,
+        send: SendFunc,
+        chat_id: int,
+        session_factory: async_sessionmaker,
+        broadcaster: Broadcaster
+    ):
+        self.broadcast_id = broadcast_id
+        self.send = send
+        self.session_factory = session_factory
+        self.broadcaster = broadcaster
+        # Чат администратора и сообщение с ходом рассылки
+        self.chat_id = chat_id
+        self.message_id: Optional[int] = None
+        self.control = BroadcastControl()
+        self.status = "queued"
+        self.result: Optional[dict] = None
+        self.task: Optional[asyncio.Task] = None
+        self._text: Optional[str] = None
+
+    @property
+    def display_status(self) -> str:
+        if self.status in ("queued", "running") and self.control.paused:
+            return "paused"
+        return self.status
+
+    @property
+    def finished(self) -> bool:
+        return self.status not in ("queued", "running")
+
+
+def format_progress(job: BroadcastJob) -> str:
+    """Текст сообщения о ходе рассылки"""
+    control = job.control
+    response = f"Рассылка #{job.broadcast_id}: {JOB_STATUS_LABELS[job.display_status]}\n\n"
+    response += f"Отправлено: {control.sent}\n"
+    response += f"Ошибок: {control.failed}\n"
+    if control.expected is not None and not job.finished:
+        response += f"Осталось получателей: ~{max(control.expected - control.done, 0)}\n"
+    if job.display_status == "running" and control.done:
+        response += f"Скорость: {control.rate():.1f} сообщ./с\n"
+        eta = control.eta()
+        if eta is not None:
+            response += f"Осталось времени: ~{format_duration(eta)}\n"
+    return response
+
+
+def get_progress_keyboard(job: BroadcastJob) -> Optional[InlineKeyboardMarkup]:
+    """Кнопки управления рассылкой"""
+    if job.finished:
+        return None
+    cancel = InlineKeyboardButton(text="✖️ Отменить", callback_data=f"bccancel_{job.broadcast_id}")
+    if job.control.paused:
+        toggle = InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"bccontinue_{job.broadcast_id}")
+    else:
+        toggle = InlineKeyboardButton(text="⏸ Пауза", callback_data=f"bcpause_{job.broadcast_id}")
+    return InlineKeyboardMarkup(inline_keyboard=[[toggle, cancel]])
+
+
+class BroadcastJobs:
+    """Очередь фоновых рассылок
+
+    Очередь одна на процесс и общая для всех ботов: одновременно выполняется
+    не больше concurrency рассылок, остальные ждут. Рассылки одного бота делят
+    лимиты скорости его broadcaster. Номера рассылок у каждого бота свои,
+    поэтому задачи различаются по паре (id бота, номер рассылки). Ход каждой
+    рассылки показывается в одном сообщении, которое редактируется не чаще
+    раза в progress_interval секунд.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = config.BROADCAST_CONCURRENCY,
+        progress_interval: float = config.BROADCAST_PROGRESS_INTERVAL
+    ):
+        self.progress_interval = progress_interval
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._jobs: Dict[Tuple[int, int], BroadcastJob] = {}
+
+    def get(self, bot: Bot, broadcast_id: int) -> Optional[BroadcastJob]:
+        """Задача рассылки бота, если она в очереди или выполняется"""
+        return self._jobs.get((bot.id, broadcast_id))
+
+    def active(self) -> List[BroadcastJob]:
+        """Все незавершенные задачи"""
+        return list(self._jobs.values())
+
+    async def submit(
+        self,
+        bot: Bot,
+        broadcast_id: int,
+        send: SendFunc,
+        chat_id: int,
+        session_factory: async_sessionmaker,
+        broadcaster: Broadcaster
+    ) -> Optional[BroadcastJob]:
+        """Постановка рассылки в очередь; None, если она уже в очереди"""
+        key = (bot.id, broadcast_id)
+        if key in self._jobs:
+            return None
+        job = BroadcastJob(broadcast_id, send, chat_id, session_factory, broadcaster)
+        self._jobs[key] = job
+        text, keyboard = format_progress(job), get_progress_keyboard(job)
+        try:
+            message = await bot.send_message(chat_id, text, reply_markup=keyboard)
+            job.message_id = message.message_id
+            job._text = text
+        except TelegramAPIError as e:
+            logging.error(f"Не удалось отправить сообщение о ходе рассылки #{broadcast_id}: {e}")
+        job.task = asyncio.create_task(self._run(bot, job))
+        return job
+
+    async def _run(self, bot: Bot, job: BroadcastJob) -> None:
+        reporter = None
+        try:
+            async with self._semaphore:
+                job.status = "running"
+                await self.refresh(bot, job)
+                reporter = asyncio.create_task(self._report(bot, job))
+                async with job.session_factory() as session:
+                    broadcast = await session.get(Broadcast, job.broadcast_id)
+                    job.result = await run_broadcast(
+                        session, broadcast, job.send, job.control, job.broadcaster
+                    )
+            job.status = "completed"
+        except asyncio.CancelledError:
+            if job.control.cancelled:
+                job.status = "cancelled"
+                # Начатую рассылку run_broadcast уже завершил; отмененную
+                # до запуска отмечаем здесь (статус меняется только у незавершенных)
+                async with job.session_factory() as session:
+                    await set_broadcast_status(session, job.broadcast_id, "cancelled")
+            else:
+                job.status = "interrupted"
+            raise
+        except BroadcastAborted as e:
+            logging.error(f"Рассылка #{job.broadcast_id} остановлена: {e.reason}")
+            job.status = "failed"
+        except Exception as e:
+            logging.exception(f"Ошибка при выполнении рассылки #{job.broadcast_id}: {e}")
+            job.status = "failed"
+        finally:
+            if reporter:
+                reporter.cancel()
+            self._jobs.pop((bot.id, job.broadcast_id), None)
+            await self.refresh(bot, job)
+            if job.status == "completed":
+                await self._notify(
+                    bot,
+                    job,
+                    f"✅ Рассылка #{job.broadcast_id} завершена!\n\n"
+                    f"Всего получателей: {job.result['total']}\n"
+                    f"Успешно отправлено: {job.result['sent']}\n"
+                    f"Ошибок: {job.result['failed']}"
+                )
+
+    async def _report(self, bot: Bot, job: BroadcastJob) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self.refresh(bot, job)
+
+    async def _notify(self, bot: Bot, job: BroadcastJob, text: str) -> None:
+        try:
+            await bot.send_message(job.chat_id, text)
+        except TelegramAPIError as e:
+            logging.error(f"Не удалось уведомить о рассылке #{job.broadcast_id}: {e}")
+
+    async def refresh(self, bot: Bot, job: BroadcastJob) -> None:
+        """Обновление сообщения о ходе рассылки, если текст изменился"""
+        if job.message_id is None:
+            return
+        text = format_progress(job)
+        if text == job._text:
+            return
+        try:
+            await bot.edit_message_text(
+                text,
+                chat_id=job.chat_id,
+                message_id=job.message_id,
+                reply_markup=get_progress_keyboard(job)
+            )
+            job._text = text
+        except TelegramAPIError as e:
+            logging.warning(f"Не удалось обновить ход рассылки #{job.broadcast_id}: {e}")
+
+    async def pause(self, bot: Bot, broadcast_id: int) -> bool:
+        """Пауза рассылки; статус сохраняется, чтобы она пережила перезапуск"""
+        job = self.get(bot, broadcast_id)
+        if not job or job.control.paused:
+            return False
+        job.control.pause()
+        async with job.session_factory() as session:
+            await set_broadcast_status(session, broadcast_id, "paused")
+        await self.refresh(bot, job)
+        return True
+
+    async def resume(self, bot: Bot, broadcast_id: int) -> bool:
+        """Продолжение рассылки после паузы"""
+        job = self.get(bot, broadcast_id)
+        if not job or not job.control.paused:
+            return False
+        async with job.session_factory() as session:
+            await set_broadcast_status(session, broadcast_id, "running")
+        job.control.resume()
+        await self.refresh(bot, job)
+        return True
+
+    async def cancel(self, bot: Bot, broadcast_id: int) -> bool:
+        """Отмена рассылки: уже отправленные сообщения остаются в статистике"""
+        job = self.get(bot, broadcast_id)
+        if not job or job.task is None:
+            return False
+        job.control.cancelled = True
+        job.task.cancel()
+        await asyncio.gather(job.task, return_exceptions=True)
+        return True
+
+    async def close(self) -> None:
+        """Остановка всех рассылок без отмены: их можно продолжить после запуска"""
+        tasks = [job.task for job in self._jobs.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Общая очередь рассылок процесса для всех ботов
+broadcast_jobs = BroadcastJobs()
@@ -0,0 +1,352 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import AsyncIterable, Awaitable, Callable, Iterable, Optional, Tuple, Union
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramMigrateToChat,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+    TelegramUnauthorizedError
+)
+
+import config
+import metrics
+
+# Функция отправки одному получателю: принимает chat_id и выполняет запрос к API
+SendFunc = Callable[[int], Awaitable[object]]
+# Получатель рассылки: внутренний ID и chat_id в Telegram
+Recipient = Tuple[int, int]
+# Обработчик результата отправки: внутренний ID получателя, признак успеха и причина ошибки
+ResultFunc = Callable[[int, bool, Optional[str]], Union[Awaitable[None], None]]
+
+# Классы ошибок отправки
+PERMANENT = "permanent"
+RETRYABLE = "retryable"
+RATE_LIMIT = "rate_limit"
+# Ошибка самой рассылки, а не получателя: продолжать ее бессмысленно
+FATAL = "fatal"
+
+# Причины, после которых чат больше не может получать сообщения
+DEAD_CHAT_REASONS = {"blocked", "deactivated", "kicked", "chat_not_found", "not_started"}
+
+# Ответы Bot API о недоступном исходном сообщении (удалено или защищено от копирования)
+SOURCE_MESSAGE_ERRORS = (
+    "message to copy not found",
+    "message to forward not found",
+    "message_id_invalid",
+    "message can't be copied",
+    "there are no messages to"
+)
+
+
+class BroadcastAborted(Exception):
+    """Рассылка остановлена ошибкой, которая повторится для каждого получателя"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def classify_error(error: Exception) -> Tuple[str, str]:
+    """Определение класса ошибки отправки и ее причины"""
+    if isinstance(error, TelegramRetryAfter):
+        return RATE_LIMIT, "flood"
+    description = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        if "blocked" in description:
+            return PERMANENT, "blocked"
+        if "deactivated" in description:
+            return PERMANENT, "deactivated"
+        if "kicked" in description or "not a member" in description:
+            return PERMANENT, "kicked"
+        if "can't initiate conversation" in description:
+            return PERMANENT, "not_started"
+        return PERMANENT, "forbidden"
+    if isinstance(error, TelegramMigrateToChat):
+        return PERMANENT, "migrated"
+    if isinstance(error, (TelegramBadRequest, TelegramNotFound)):
+        if any(text in description for text in SOURCE_MESSAGE_ERRORS):
+            return FATAL, "source_unavailable"
+        if ("chat not found" in description or "user not found" in description
+                or "peer_id_invalid" in description):
+            return PERMANENT, "chat_not_found"
+        return PERMANENT, "bad_request"
+    if isinstance(error, TelegramUnauthorizedError):
+        return PERMANENT, "unauthorized"
+    if isinstance(error, TelegramServerError):
+        return RETRYABLE, "server_error"
+    if isinstance(error, (TelegramNetworkError, asyncio.TimeoutError, OSError)):
+        return RETRYABLE, "network"
+    return RETRYABLE, "error"
+
+
+class TokenBucket:
+    """Глобальный ограничитель частоты запросов (ведро токенов)"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Остановить выдачу токенов на время flood control"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+        # Токены копятся только после окончания блокировки, иначе сразу
+        # после нее ушла бы пачка из capacity запросов
+        self._updated = self._blocked_until
+
+    async def acquire(self) -> None:
+        """Дождаться свободного токена"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatRateLimiter:
+    """Ограничение частоты отправки в один чат"""
+
+    def __init__(self, rate: float, max_chats: int = 10000):
+        self.interval = 1 / rate
+        self.max_chats = max_chats
+        self._next_slot = OrderedDict()
+
+    async def acquire(self, chat_id: int) -> None:
+        """Дождаться следующего разрешенного слота для чата"""
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(chat_id, 0.0))
+        self._next_slot[chat_id] = slot + self.interval
+        self._next_slot.move_to_end(chat_id)
+        while len(self._next_slot) > self.max_chats:
+            self._next_slot.popitem(last=False)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class BroadcastControl:
+    """Прогресс идущей рассылки, пауза и признак отмены"""
+
+    def __init__(self, expected: Optional[int] = None):
+        self.expected = expected
+        self.sent = 0
+        self.failed = 0
+        self.cancelled = False
+        self._running = asyncio.Event()
+        self._running.set()
+        self._active_seconds = 0.0
+        self._resumed_at = time.monotonic()
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+    def pause(self) -> None:
+        """Остановить выдачу новых получателей воркерам"""
+        if not self.paused:
+            self._active_seconds += time.monotonic() - self._resumed_at
+            self._running.clear()
+
+    def resume(self) -> None:
+        """Продолжить после паузы"""
+        if self.paused:
+            self._resumed_at = time.monotonic()
+            self._running.set()
+
+    async def wait(self) -> None:
+        """Дождаться снятия паузы"""
+        await self._running.wait()
+
+    def record(self, reason: Optional[str]) -> None:
+        if reason:
+            self.failed += 1
+        else:
+            self.sent += 1
+
+    def rate(self) -> float:
+        """Средняя скорость без учета пауз (сообщений в секунду)"""
+        elapsed = self._active_seconds
+        if not self.paused:
+            elapsed += time.monotonic() - self._resumed_at
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        """Оценка оставшегося времени в секундах"""
+        rate = self.rate()
+        if self.expected is None or not rate:
+            return None
+        return max(self.expected - self.done, 0) / rate
+
+
+class Broadcaster:
+    """Параллельная отправка сообщений с учетом лимитов Telegram"""
+
+    def __init__(
+        self,
+        rate_limiter: TokenBucket,
+        chat_limiter: ChatRateLimiter,
+        workers: int = config.BROADCAST_WORKERS,
+        max_retries: int = config.BROADCAST_MAX_RETRIES,
+        name: str = "",
+        max_flood_retries: int = config.BROADCAST_MAX_FLOOD_RETRIES
+    ):
+        self.rate_limiter = rate_limiter
+        self.chat_limiter = chat_limiter
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_flood_retries = max_flood_retries
+        # Имя бота в метках метрик: ID рассылок разных ботов совпадают
+        self.name = name
+
+    async def deliver(
+        self,
+        chat_id: int,
+        send: SendFunc,
+        max_retries: Optional[int] = None
+    ) -> Optional[str]:
+        """Отправка одному получателю с повторными попытками
+
+        Возвращает None при успехе или причину ошибки. Если недоступно
+        исходное сообщение, вызывает BroadcastAborted. После max_flood_retries
+        ответов 429 подряд получатель пропускается с причиной flood.
+        """
+        if max_retries is None:
+            max_retries = self.max_retries
+        attempt = 0
+        floods = 0
+        while True:
+            await self.chat_limiter.acquire(chat_id)
+            await self.rate_limiter.acquire()
+            try:
+                await send(chat_id)
+                return None
+            except Exception as e:
+                kind, reason = classify_error(e)
+                if kind == RATE_LIMIT:
+                    # Telegram сообщает точное время ожидания - ждем ровно столько
+                    self.rate_limiter.pause(e.retry_after)
+                    floods += 1
+                    if floods > self.max_flood_retries:
+                        logging.warning(f"Чат {chat_id} пропущен: {floods} ответов 429 подряд")
+                        return reason
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                if kind == FATAL:
+                    raise BroadcastAborted(reason) from e
+                # Постоянные ошибки не повторяем: заблокированный чат не оживет через секунду
+                attempt += 1
+                if kind == PERMANENT or attempt >= max_retries:
+                    if kind != PERMANENT:
+                        logging.warning(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+                    return reason
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+
+    async def run(
+        self,
+        recipients: Union[Iterable[Recipient], AsyncIterable[Recipient]],
+        send: SendFunc,
+        on_result: Optional[ResultFunc] = None,
+        expected: Optional[int] = None,
+        label: str = "",
+        control: Optional[BroadcastControl] = None,
+        rate: Optional[float] = None
+    ) -> dict:
+        """Рассылка по списку получателей через пул воркеров
+
+        expected - ожидаемое число получателей для оценки времени завершения,
+        label - имя рассылки в метриках, control - пауза и прогресс рассылки,
+        rate - собственный лимит рассылки (сообщений в секунду) в дополнение к общему.
+        """
+        if label and self.name:
+            label = f"{self.name}:{label}"
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        # Без запаса токенов: отправки идут равномерно, а не пачками
+        own_limiter = TokenBucket(rate, capacity=1) if rate else None
+        stats = {"total": 0, "sent": 0, "failed": 0}
+        control = control or BroadcastControl()
+        if expected is not None:
+            control.expected = expected
+
+        def report(reason: Optional[str]) -> None:
+            control.record(reason)
+            metrics.BROADCAST_MESSAGES.inc(result=reason or "sent")
+            if not label:
+                return
+            metrics.BROADCAST_QUEUE.set(queue.qsize(), broadcast=label)
+            metrics.BROADCAST_RATE.set(control.rate(), broadcast=label)
+            if control.expected is not None:
+                metrics.BROADCAST_REMAINING.set(max(control.expected - control.done, 0), broadcast=label)
+                metrics.BROADCAST_ETA.set(control.eta() or 0, broadcast=label)
+
+        async def worker():
+            while True:
+                recipient = await queue.get()
+                try:
+                    if recipient is None:
+                        return
+                    recipient_id, chat_id = recipient
+                    await control.wait()
+                    if own_limiter:
+                        await own_limiter.acquire()
+                    reason = await self.deliver(chat_id, send)
+                    stats["failed" if reason else "sent"] += 1
+                    report(reason)
+                    if on_result:
+                        result = on_result(recipient_id, reason is None, reason)
+                        if asyncio.iscoroutine(result):
+                            await result
+                finally:
+                    queue.task_done()
+
+        async def producer():
+            if hasattr(recipients, "__aiter__"):
+                async for recipient in recipients:
+                    stats["total"] += 1
+                    await queue.put(recipient)
+            else:
+                for recipient in recipients:
+                    stats["total"] += 1
+                    await queue.put(recipient)
+            for _ in range(self.workers):
+                await queue.put(None)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        tasks.append(asyncio.create_task(producer()))
+        try:
+            # Ошибка в любом воркере или источнике получателей прерывает рассылку
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if label:
+                for gauge in (metrics.BROADCAST_QUEUE, metrics.BROADCAST_RATE,
+                              metrics.BROADCAST_REMAINING, metrics.BROADCAST_ETA):
+                    gauge.remove(broadcast=label)
+        return stats
+
+
+def create_broadcaster(rate: float = config.BROADCAST_RATE, name: str = "") -> Broadcaster:
+    """Отправка с собственными ограничителями: лимиты Telegram действуют на токен бота"""
+    return Broadcaster(TokenBucket(rate), ChatRateLimiter(config.PER_CHAT_RATE), name=name)
+
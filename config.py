@@ -0,0 +1,133 @@
+import os
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+# ID администратора читается один раз при запуске
+ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
+# Файл базы данных SQLite
+DATABASE_PATH = os.getenv("DATABASE_PATH", "bot_database.db")
+
+# Несколько ботов в одном процессе: JSON-файл со списком ботов (см. tenants.py).
+# Если не задан, процесс обслуживает одного бота из BOT_TOKEN, ADMIN_ID и DATABASE_PATH
+BOTS_FILE = os.getenv("BOTS_FILE", "")
+# Соединений к Bot API в общей HTTP-сессии всех ботов процесса
+API_CONNECTIONS = int(os.getenv("API_CONNECTIONS", "100"))
+
+# Настройки рассылки
+# Глобальный лимит Telegram для бота ~30 сообщений в секунду
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "28"))
+# Лимит для одного чата (Telegram допускает ~1 сообщение в секунду)
+PER_CHAT_RATE = float(os.getenv("PER_CHAT_RATE", "1"))
+# Количество одновременных отправок
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "20"))
+# Количество попыток отправки одному получателю
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+# Сколько раз подряд ждать по ответу 429 при отправке одному получателю
+BROADCAST_MAX_FLOOD_RETRIES = int(os.getenv("BROADCAST_MAX_FLOOD_RETRIES", "5"))
+# Размер страницы получателей и пакета записей в журнал доставки
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+# Максимальный интервал между сохранениями журнала доставки (секунды)
+BROADCAST_FLUSH_INTERVAL = float(os.getenv("BROADCAST_FLUSH_INTERVAL", "2"))
+# Количество рассылок, которые выполняются одновременно; остальные ждут в очереди
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "1"))
+# Интервал обновления сообщения о ходе рассылки (секунды)
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "15"))
+# Максимальный интервал проверки отложенных рассылок (секунды)
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", "60"))
+# Часовой пояс администратора для времени отложенных рассылок (часы от UTC)
+TIMEZONE_OFFSET = float(os.getenv("TIMEZONE_OFFSET", "0"))
+# Сколько ждать остальные сообщения альбома после первого (секунды)
+ALBUM_LATENCY = float(os.getenv("ALBUM_LATENCY", "0.5"))
+
+# Антифлуд: ведро на FLOOD_BURST сообщений пользователя, пополняется
+# со скоростью FLOOD_RATE сообщений в секунду (0 - без ограничения)
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "0.5"))
+FLOOD_BURST = int(os.getenv("FLOOD_BURST", "10"))
+# Сообщения пользователя за это время с первого объединяются в одно (секунды, 0 - не объединять)
+FLOOD_WINDOW = float(os.getenv("FLOOD_WINDOW", "5"))
+# Количество пользователей, для которых хранится состояние антифлуда
+FLOOD_CACHE_SIZE = int(os.getenv("FLOOD_CACHE_SIZE", "10000"))
+
+# Настройки SQLite
+# NORMAL в режиме WAL безопасен и намного быстрее FULL
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+# Отрицательное значение - размер кэша в килобайтах
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-20000"))
+# Ожидание блокировки базы в миллисекундах
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+# Пул соединений асинхронного движка: одна сессия на обновление
+# (у каждого бота процесса свой пул, так как у каждого своя база)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Сообщения пользователя, отправленные в течение этого времени после
+# предыдущего, продолжают тот же диалог (часы)
+DIALOG_TIMEOUT_HOURS = float(os.getenv("DIALOG_TIMEOUT_HOURS", "24"))
+# Количество сообщений на одной странице диалога
+DIALOG_PAGE_SIZE = int(os.getenv("DIALOG_PAGE_SIZE", "10"))
+# Количество сообщений на одной странице /messages
+INBOX_PAGE_SIZE = int(os.getenv("INBOX_PAGE_SIZE", "5"))
+# Количество результатов на одной странице /search
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "5"))
+# Период сводной статистики /stats по умолчанию (дни)
+STATS_WINDOW_DAYS = int(os.getenv("STATS_WINDOW_DAYS", "30"))
+# Количество рассылок на одной странице /stats
+STATS_PAGE_SIZE = int(os.getenv("STATS_PAGE_SIZE", "5"))
+
+# Хранение истории: прочитанные сообщения и завершенные рассылки старше этого
+# срока переносятся из базы в архив (дни, 0 - хранить в базе бессрочно)
+MESSAGE_RETENTION_DAYS = float(os.getenv("MESSAGE_RETENTION_DAYS", "0"))
+BROADCAST_RETENTION_DAYS = float(os.getenv("BROADCAST_RETENTION_DAYS", "0"))
+# Каталог архива: файлы <таблица>-ГГГГ-ММ.jsonl.gz, которые только дополняются
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Интервал переноса (секунды) и количество записей в одной транзакции
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+# Страниц базы, возвращаемых системе за один проход incremental vacuum (0 - не сжимать файл)
+VACUUM_PAGES = int(os.getenv("VACUUM_PAGES", "2000"))
+
+# Входящие сообщения и регистрации пользователей пишутся в базу пакетами:
+# при накоплении WRITE_BEHIND_BATCH_SIZE записей или раз в WRITE_BEHIND_INTERVAL секунд
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "1"))
+# Если база недоступна: пауза между попытками растет до WRITE_BEHIND_MAX_BACKOFF секунд,
+# а сверх WRITE_BEHIND_MAX_PENDING записей новые записи отбрасываются
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv("WRITE_BEHIND_MAX_BACKOFF", "60"))
+# Размер кэша соответствия Telegram ID и users.id
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+# Хранилище состояний диалогов: memory, sqlite или redis
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+# Время жизни незавершенного состояния (секунды)
+STATE_TTL = float(os.getenv("STATE_TTL", "3600"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес бота; если не задан, вебхук в Telegram не регистрируется
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Количество одновременно обрабатываемых обновлений
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "50"))
+# Количество одновременных соединений Telegram к вебхуку
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Время ожидания обработки принятых обновлений при остановке (секунды)
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "30"))
+
+# Метрики в формате Prometheus на отдельном порту (0 - не запускать)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+# Обновления дольше этого времени пишутся в журнал (мс, 0 - не писать)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+# Каталог для профилей cProfile и доля профилируемых обновлений
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
@@ -1,7 +1,12 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import event, Column, Integer, Float, String, Date, DateTime, Boolean, ForeignKey, Index, JSON
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 from datetime import datetime
+from typing import Optional, Tuple
+import config
+from metrics import instrument_engine
 
 Base = declarative_base()
 
@@ -15,29 +20,153 @@ class User(Base):
     last_name = Column(String)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Время последнего сообщения или /start (обновляется пакетно, см. writebehind.py)
+    last_seen = Column(DateTime, nullable=True)
     messages = relationship("UserMessage", back_populates="user")
+    
+    __table_args__ = (
+        # Постраничная выборка активных получателей рассылки
+        Index('ix_users_is_active_id', 'is_active', 'id'),
+        # Подсчет аудитории сегментов рассылки только по индексу
+        Index('ix_users_is_active_last_seen', 'is_active', 'last_seen'),
+        Index('ix_users_is_active_created_at', 'is_active', 'created_at'),
+    )
 
 class Broadcast(Base):
     __tablename__ = 'broadcasts'
     
     id = Column(Integer, primary_key=True)
     message_text = Column(String)
+    # Исходное сообщение администратора для возобновления рассылки
+    source_chat_id = Column(Integer, nullable=True)
+    source_message_id = Column(Integer, nullable=True)
+    # ID всех сообщений, если рассылается альбом (media group)
+    source_message_ids = Column(JSON, nullable=True)
+    # Сегмент получателей (см. segments.py); NULL - все активные пользователи
+    segment = Column(JSON, nullable=True)
+    # Отложенный запуск (scheduled до этого времени) и окно доставки, UTC
+    scheduled_at = Column(DateTime, nullable=True)
+    deliver_until = Column(DateTime, nullable=True)
+    # Собственный лимит скорости рассылки, сообщений в секунду
+    max_rate = Column(Float, nullable=True)
+    status = Column(String, default='running')
+    # Все получатели с users.id <= last_user_id уже обработаны
+    last_user_id = Column(Integer, default=0)
     sent_count = Column(Integer, default=0)
     failed_count = Column(Integer, default=0)
+    # Количество ошибок по причинам: {"blocked": 10, "network": 2}
+    failure_reasons = Column(JSON, default=dict)
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index('ix_broadcasts_created_at', 'created_at'),
+        # Выборка рассылок, которым пора начаться
+        Index('ix_broadcasts_status_scheduled_at', 'status', 'scheduled_at'),
+    )
+
+class BroadcastDelivery(Base):
+    __tablename__ = 'broadcast_deliveries'
+    
+    broadcast_id = Column(Integer, ForeignKey('broadcasts.id', ondelete='CASCADE'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    status = Column(String)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class BroadcastDailyStats(Base):
+    __tablename__ = 'broadcast_daily_stats'
+    
+    # Сводка по завершенным рассылкам за день их запуска
+    day = Column(Date, primary_key=True)
+    broadcasts = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    duration_seconds = Column(Float, default=0)
 
 class UserMessage(Base):
     __tablename__ = 'user_messages'
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
+    # Сообщение, на которое отвечает это сообщение (для диалогов)
+    parent_id = Column(Integer, ForeignKey('user_messages.id', ondelete='SET NULL'), nullable=True)
+    # ID первого сообщения диалога: весь диалог выбирается одним запросом
+    thread_id = Column(Integer, nullable=True)
     message_text = Column(String)
+    is_admin = Column(Boolean, default=False)
     is_read = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     user = relationship("User", back_populates="messages")
+    
+    __table_args__ = (
+        Index('ix_user_messages_is_read_id', 'is_read', 'id'),
+        Index('ix_user_messages_created_at', 'created_at'),
+        Index('ix_user_messages_user_id', 'user_id'),
+        Index('ix_user_messages_parent_id', 'parent_id'),
+        Index('ix_user_messages_thread_id_id', 'thread_id', 'id'),
+    )
+
+class ConversationState(Base):
+    __tablename__ = 'conversation_states'
+    
+    key = Column(String, primary_key=True)
+    value = Column(JSON)
+    # Unix-время истечения; NULL - бессрочно
+    expires_at = Column(Float, nullable=True)
+    
+    __table_args__ = (
+        Index('ix_conversation_states_expires_at', 'expires_at'),
+    )
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настройки SQLite для каждого нового соединения"""
+    cursor = dbapi_connection.cursor()
+    # Новая база сразу создается в режиме auto_vacuum=INCREMENTAL (до перехода
+    # в WAL); существующую переводит только VACUUM (см. retention.py)
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL: читатели не блокируются записью во время рассылки
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size={config.SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
 
 # Создание подключения к базе данных
-engine = create_engine('sqlite:///bot_database.db')
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine) 
\ No newline at end of file
+# Схема создается и обновляется миграциями при запуске (см. migrations.py)
+def create_database(path: str) -> Tuple[AsyncEngine, async_sessionmaker]:
+    """Асинхронное подключение к файлу базы (aiosqlite) и фабрика сессий"""
+    async_engine = create_async_engine(
+        f'sqlite+aiosqlite:///{path}',
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW
+    )
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    # Количество и время запросов для метрик (см. metrics.py)
+    instrument_engine(async_engine.sync_engine)
+    return async_engine, async_sessionmaker(async_engine, expire_on_commit=False)
+
+# Подключение к DATABASE_PATH для бота из переменных окружения. Создается
+# при первом обращении: при BOTS_FILE у каждого бота своя база, и эта не нужна
+_default_database: Optional[Tuple[AsyncEngine, async_sessionmaker]] = None
+
+
+def default_database() -> Tuple[AsyncEngine, async_sessionmaker]:
+    """Подключение и фабрика сессий для базы DATABASE_PATH"""
+    global _default_database
+    if _default_database is None:
+        _default_database = create_database(config.DATABASE_PATH)
+    return _default_database
+
+
+def __getattr__(name: str):
+    """database.async_engine и database.async_session - подключение по умолчанию"""
+    if name == "async_engine":
+        return default_database()[0]
+    if name == "async_session":
+        return default_database()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+ 
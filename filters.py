@@ -0,0 +1,24 @@
+from typing import FrozenSet, Iterable, Optional, Union
+
+from aiogram.filters import BaseFilter
+from aiogram.types import CallbackQuery, Message
+
+import config
+from tenants import BotTenant
+
+
+class IsAdmin(BaseFilter):
+    """Фильтр администратора по заранее вычисленному множеству ID
+
+    Если обновление пришло боту процесса с собственным администратором
+    (аргумент tenant, см. tenants.py), проверяется его администратор.
+    """
+
+    def __init__(self, admin_ids: Optional[Iterable[int]] = None):
+        self.admin_ids: FrozenSet[int] = frozenset(
+            admin_ids if admin_ids is not None else (config.ADMIN_ID,)
+        )
+
+    async def __call__(self, event: Union[Message, CallbackQuery], tenant: Optional[BotTenant] = None) -> bool:
+        admin_ids = tenant.admin_ids if tenant is not None else self.admin_ids
+        return event.from_user is not None and event.from_user.id in admin_ids
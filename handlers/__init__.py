@@ -0,0 +1,13 @@
+from aiogram import Dispatcher
+
+from handlers.admin import router as admin_router
+from handlers.user import router as user_router
+
+
+def setup_routers(dispatcher: Dispatcher) -> None:
+    """Подключение роутеров: сначала администратора, затем пользователей"""
+    dispatcher.include_router(admin_router)
+    dispatcher.include_router(user_router)
+
+
+__all__ = ["admin_router", "user_router", "setup_routers"]
@@ -0,0 +1,769 @@
+import logging
+from typing import List, Optional
+from aiogram import Bot, F, Router
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy.ext.asyncio import AsyncSession
+import config
+from broadcast_jobs import broadcast_jobs
+from filters import IsAdmin
+from scheduler import SCHEDULE_HELP, describe_schedule, format_local, parse_schedule
+from segments import SEGMENT_HELP, SEGMENT_PRESETS, count_audience, describe_segment, parse_segment
+from states import AdminStates
+from tenants import BotTenant
+from utils import (
+    create_broadcast,
+    copy_sender,
+    cancel_scheduled_broadcast,
+    get_scheduled_broadcasts,
+    search_messages,
+    get_resumable_broadcast,
+    set_broadcast_status,
+    get_broadcast_stats,
+    get_broadcast_summary,
+    get_or_create_user,
+    save_admin_reply,
+    get_user_message,
+    delete_user_message,
+    get_unread_messages,
+    mark_messages_as_read,
+    get_user_by_id,
+    get_dialog,
+    delete_dialog,
+    clear_broadcast_stats,
+    send_message_with_retry,
+    get_interrupted_broadcasts,
+    format_duration
+)
+
+# Все обработчики роутера доступны только администратору:
+# проверка выполняется один раз на уровне роутера
+router = Router(name="admin")
+router.message.filter(IsAdmin())
+router.callback_query.filter(IsAdmin())
+
+# Описания причин ошибок доставки
+FAILURE_REASON_LABELS = {
+    "blocked": "заблокировали бота",
+    "deactivated": "аккаунт удален",
+    "kicked": "бот исключен",
+    "chat_not_found": "чат не найден",
+    "not_started": "не начинали диалог с ботом",
+    "forbidden": "нет доступа",
+    "migrated": "чат перенесен",
+    "bad_request": "некорректный запрос",
+    "unauthorized": "неверный токен",
+    "server_error": "ошибка сервера",
+    "network": "ошибка сети",
+    "flood": "лимит Telegram (429)",
+    "error": "прочие"
+}
+
+# Статусы рассылок, которые показываются в статистике
+BROADCAST_STATUS_LABELS = {
+    "running": "выполняется",
+    "paused": "на паузе",
+    "cancelled": "отменена",
+    "failed": "остановлена: исходное сообщение недоступно",
+    "scheduled": "запланирована"
+}
+
+# Запросы последних сообщений с результатами поиска, которые хранятся в данных FSM
+SEARCH_HISTORY_SIZE = 20
+
+def get_reply_keyboard(message_id: int) -> InlineKeyboardMarkup:
+    """Создание клавиатуры для ответа на сообщение"""
+    keyboard = [
+        [InlineKeyboardButton(text="✍️ Ответить", callback_data=f"reply_{message_id}")],
+        [InlineKeyboardButton(text="💬 Диалог", callback_data=f"dialog_{message_id}")],
+        [InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{message_id}")]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def get_dialog_keyboard(message_id: int, reply_to: int, next_after_id: int = None) -> InlineKeyboardMarkup:
+    """Создание клавиатуры для просмотра диалога"""
+    keyboard = []
+    if next_after_id:
+        keyboard.append([InlineKeyboardButton(text="➡️ Дальше", callback_data=f"dialog_{message_id}_{next_after_id}")])
+    keyboard.append([InlineKeyboardButton(text="✍️ Ответить", callback_data=f"reply_{reply_to}")])
+    keyboard.append([InlineKeyboardButton(text="🗑 Удалить диалог", callback_data=f"deldialog_{message_id}")])
+    keyboard.append([InlineKeyboardButton(text="📬 Входящие", callback_data="inbox_0")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def format_dialog(messages: list) -> str:
+    """Форматирование диалога в виде ветки сообщений"""
+    response = "💬 Диалог:\n\n"
+    for msg in messages:
+        text = msg['message'] if len(msg['message']) <= 300 else msg['message'][:300] + "..."
+        # Ответы на конкретное сообщение показываем с отступом
+        prefix, indent = ("↳ ", "    ") if msg['parent_id'] else ("", "")
+        author = "🛡 Администратор" if msg['is_admin'] else f"👤 @{msg['username']}"
+        response += f"{indent}{prefix}{author} ({msg['created_at']}):\n{indent}{text}\n\n"
+    return response
+
+def get_stats_keyboard(days: int, stats: list, has_newer: bool, has_older: bool) -> InlineKeyboardMarkup:
+    """Создание клавиатуры для статистики"""
+    keyboard = []
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"stats_{days}_new_{stats[0]['id']}"))
+    if has_older:
+        navigation.append(InlineKeyboardButton(text="Старее ➡️", callback_data=f"stats_{days}_old_{stats[-1]['id']}"))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton(text="🗑 Очистить статистику", callback_data="clear_stats")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def get_segment_keyboard() -> InlineKeyboardMarkup:
+    """Кнопки готовых сегментов рассылки"""
+    buttons = [
+        InlineKeyboardButton(text=label, callback_data=f"segment_{key}")
+        for key, (label, _) in SEGMENT_PRESETS.items()
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=[buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+
+async def format_broadcast_prompt(session: AsyncSession, segment: dict, schedule: dict) -> str:
+    """Приглашение отправить сообщение с размером аудитории сегмента"""
+    audience = await count_audience(session, segment)
+    return (
+        f"Получатели: {describe_segment(segment)} ({audience}).\n"
+        f"Отправка: {describe_schedule(schedule)}.\n"
+        "Выберите другой сегмент кнопкой или аргументами /broadcast (/help).\n\n"
+        "Отправьте сообщение для рассылки.\n"
+        "Поддерживаются все типы сообщений (текст, фото, видео, альбомы и т.д.)"
+    )
+
+def format_stats_page(summary: dict, stats: list) -> str:
+    """Форматирование сводки и страницы рассылок"""
+    response = f"📊 Статистика рассылок за {summary['days']} дн.:\n\n"
+    response += f"Рассылок завершено: {summary['broadcasts']}\n"
+    response += f"Отправлено: {summary['sent']}\n"
+    response += f"Ошибок: {summary['failed']}\n"
+    response += f"Доставляемость: {summary['delivery_rate']:.1f}%\n"
+    response += f"Среднее время рассылки: {format_duration(summary['avg_duration'])}\n\n"
+    
+    for stat in stats:
+        response += f"ID: {stat['id']}\n"
+        response += f"Сообщение: {stat['message']}\n"
+        response += f"Отправлено: {stat['sent']}\n"
+        response += f"Ошибок: {stat['failed']}\n"
+        if stat['failure_reasons']:
+            reasons = ", ".join(
+                f"{FAILURE_REASON_LABELS.get(reason, reason)}: {count}"
+                for reason, count in stat['failure_reasons'].items()
+            )
+            response += f"Причины ошибок: {reasons}\n"
+        if stat['status'] in BROADCAST_STATUS_LABELS:
+            response += f"Статус: {BROADCAST_STATUS_LABELS[stat['status']]}\n"
+        response += f"Создано: {stat['created_at']}\n"
+        if stat['completed_at']:
+            response += f"Завершено: {stat['completed_at']}\n"
+        response += "\n"
+    return response
+
+async def load_stats_page(session: AsyncSession, days: int, before_id: int = None, after_id: int = None):
+    """Загрузка сводки и страницы рассылок"""
+    page_size = config.STATS_PAGE_SIZE
+    summary = await get_broadcast_summary(session, days)
+    # Берем на одну рассылку больше, чтобы узнать, есть ли еще страница
+    stats = await get_broadcast_stats(session, before_id, after_id, page_size + 1)
+    
+    if after_id is not None:
+        has_newer = len(stats) > page_size
+        stats = stats[-page_size:]
+        has_older = True
+    else:
+        has_older = len(stats) > page_size
+        stats = stats[:page_size]
+        has_newer = before_id is not None
+    
+    if not stats:
+        return None
+    return format_stats_page(summary, stats), get_stats_keyboard(days, stats, has_newer, has_older)
+
+def get_scheduled_keyboard(broadcast_ids: list) -> InlineKeyboardMarkup:
+    """Кнопки отмены отложенных рассылок"""
+    keyboard = [
+        [InlineKeyboardButton(text=f"✖️ Отменить рассылку #{broadcast_id}", callback_data=f"unschedule_{broadcast_id}")]
+        for broadcast_id in broadcast_ids
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def get_resume_keyboard(broadcast_ids: list) -> InlineKeyboardMarkup:
+    """Создание клавиатуры для продолжения прерванных рассылок"""
+    keyboard = [
+        [InlineKeyboardButton(text=f"▶️ Продолжить рассылку #{broadcast_id}", callback_data=f"resume_{broadcast_id}")]
+        for broadcast_id in broadcast_ids
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def format_inbox_page(messages: list) -> str:
+    """Форматирование страницы входящих сообщений"""
+    response = "📬 Сообщения от пользователей:\n\n"
+    for number, msg in enumerate(messages, 1):
+        text = msg['message'] if len(msg['message']) <= 500 else msg['message'][:500] + "..."
+        response += f"{number}. 👤 @{msg['username']} ({msg['created_at']}):\n"
+        response += f"{text}\n\n"
+    return response
+
+def get_inbox_keyboard(messages: list, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    """Создание клавиатуры для страницы входящих сообщений"""
+    first_id, last_id = messages[0]['id'], messages[-1]['id']
+    keyboard = [
+        [
+            InlineKeyboardButton(text=f"✍️ {number}", callback_data=f"reply_{msg['id']}"),
+            InlineKeyboardButton(text=f"💬 {number}", callback_data=f"dialog_{msg['id']}"),
+            InlineKeyboardButton(text=f"🗑 {number}", callback_data=f"inboxdel_{msg['id']}_{first_id - 1}")
+        ]
+        for number, msg in enumerate(messages, 1)
+    ]
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="⬅️", callback_data=f"inboxprev_{first_id}"))
+    navigation.append(InlineKeyboardButton(text="✅ Прочитано", callback_data=f"inboxread_{first_id}_{last_id}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="➡️", callback_data=f"inbox_{last_id}"))
+    keyboard.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def format_search_page(query: str, results: list, page: int) -> str:
+    """Форматирование страницы результатов поиска"""
+    response = f"🔎 Поиск «{query}», страница {page + 1}:\n\n"
+    for number, msg in enumerate(results, 1):
+        response += f"{number}. 👤 @{msg['username']} ({msg['created_at']}):\n"
+        response += f"{msg['message']}\n\n"
+    return response
+
+def get_search_keyboard(results: list, page: int, has_next: bool) -> InlineKeyboardMarkup:
+    """Кнопки результатов поиска: те же действия, что во входящих"""
+    keyboard = [
+        [
+            InlineKeyboardButton(text=f"✍️ {number}", callback_data=f"reply_{msg['id']}"),
+            InlineKeyboardButton(text=f"💬 {number}", callback_data=f"dialog_{msg['id']}"),
+            InlineKeyboardButton(text=f"🗑 {number}", callback_data=f"searchdel_{msg['id']}_{page}")
+        ]
+        for number, msg in enumerate(results, 1)
+    ]
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(text="⬅️", callback_data=f"search_{page - 1}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="➡️", callback_data=f"search_{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+async def load_search_page(session: AsyncSession, query: str, page: int = 0):
+    """Загрузка страницы результатов поиска; None - поиск недоступен"""
+    page_size = config.SEARCH_PAGE_SIZE
+    # Берем на один результат больше, чтобы узнать, есть ли следующая страница
+    results = await search_messages(session, query, page * page_size, page_size + 1)
+    if results is None:
+        return None
+    if not results:
+        return "Ничего не найдено.", None
+    has_next = len(results) > page_size
+    results = results[:page_size]
+    return format_search_page(query, results, page), get_search_keyboard(results, page, has_next)
+
+async def save_search_query(state: FSMContext, message_id: int, query: str) -> None:
+    """Запоминание запроса сообщения с результатами поиска
+
+    Запрос может не поместиться в callback_data, поэтому хранится в данных FSM
+    по ID сообщения: у каждого сообщения с результатами свой запрос.
+    """
+    queries = dict((await state.get_data()).get("search_queries", {}))
+    queries[str(message_id)] = query
+    # Храним только последние запросы: словари сохраняют порядок добавления
+    await state.update_data(search_queries=dict(list(queries.items())[-SEARCH_HISTORY_SIZE:]))
+
+async def finish_scenario(state: FSMContext) -> dict:
+    """Завершение сценария: состояние и его данные сбрасываются, запросы поиска остаются"""
+    data = await state.get_data()
+    await state.clear()
+    if data.get("search_queries"):
+        await state.set_data({"search_queries": data["search_queries"]})
+    return data
+
+async def load_inbox_page(session: AsyncSession, after_id: int = 0, before_id: int = None):
+    """Загрузка страницы входящих сообщений одним запросом"""
+    page_size = config.INBOX_PAGE_SIZE
+    # Берем на одно сообщение больше, чтобы узнать, есть ли еще страница
+    messages = await get_unread_messages(session, after_id, before_id, page_size + 1)
+    
+    if before_id is not None:
+        has_prev = len(messages) > page_size
+        messages = messages[-page_size:]
+        has_next = True
+    else:
+        has_next = len(messages) > page_size
+        messages = messages[:page_size]
+        has_prev = after_id > 0
+    
+    if not messages:
+        return None
+    return format_inbox_page(messages), get_inbox_keyboard(messages, has_prev, has_next)
+
+
+# Обработчик команды /start
+@router.message(Command("start"))
+async def cmd_start(message: Message, session: AsyncSession):
+    # Сохраняем пользователя в базу данных
+    await get_or_create_user(
+        session,
+        message.from_user.id,
+        message.from_user.username,
+        message.from_user.first_name,
+        message.from_user.last_name
+    )
+    await message.answer(
+        "👋 Привет, администратор!\n\n"
+        "Доступные команды:\n"
+        "/broadcast - Начать рассылку\n"
+        "/stats - Статистика рассылок\n"
+        "/messages - Просмотр сообщений от пользователей\n"
+        "/search текст - Поиск по сообщениям пользователей\n"
+        "/clear_stats - Очистить статистику\n"
+        "/help - Помощь"
+    )
+
+# Обработчик команды /broadcast [сегмент] [время]
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: Message, command: CommandObject, state: FSMContext, session: AsyncSession):
+    try:
+        schedule, segment_args = parse_schedule(command.args)
+        segment = parse_segment(segment_args)
+    except ValueError as e:
+        await message.answer(f"❌ {e}\n\n{SEGMENT_HELP}\n\n{SCHEDULE_HELP}")
+        return
+    
+    await state.set_state(AdminStates.waiting_for_broadcast)
+    await state.update_data(segment=segment, schedule=schedule)
+    await message.answer(
+        await format_broadcast_prompt(session, segment, schedule),
+        reply_markup=get_segment_keyboard()
+    )
+
+# Обработчик команды /stats
+@router.message(Command("stats"))
+async def cmd_stats(message: Message, command: CommandObject, session: AsyncSession):
+    # Период можно указать аргументом: /stats 7
+    days = config.STATS_WINDOW_DAYS
+    if command.args and command.args.strip().isdigit():
+        days = max(1, int(command.args.strip()))
+    
+    page = await load_stats_page(session, days)
+    if not page:
+        await message.answer("Пока нет статистики рассылок.")
+        return
+    
+    text, keyboard = page
+    await message.answer(text, reply_markup=keyboard)
+
+# Обработчик команды /messages
+@router.message(Command("messages"))
+async def cmd_messages(message: Message, session: AsyncSession):
+    page = await load_inbox_page(session)
+    if not page:
+        await message.answer("Нет новых сообщений от пользователей.")
+        return
+    
+    text, keyboard = page
+    await message.answer(text, reply_markup=keyboard)
+
+# Обработчик команды /search
+@router.message(Command("search"))
+async def cmd_search(message: Message, command: CommandObject, state: FSMContext, session: AsyncSession):
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("Укажите, что искать: /search текст")
+        return
+    
+    page = await load_search_page(session, query)
+    if page is None:
+        await message.answer("Поиск недоступен: SQLite собран без FTS5.")
+        return
+    text, keyboard = page
+    result = await message.answer(text, reply_markup=keyboard)
+    # Запрос нужен для перехода между страницами этого сообщения
+    await save_search_query(state, result.message_id, query)
+
+# Обработчик команды /resume
+@router.message(Command("resume"))
+async def cmd_resume(message: Message, session: AsyncSession, bot: Bot):
+    # Рассылки из очереди этого процесса не считаются прерванными
+    broadcasts = [
+        b for b in await get_interrupted_broadcasts(session)
+        if not broadcast_jobs.get(bot, b.id)
+    ]
+    
+    if not broadcasts:
+        await message.answer("Нет прерванных рассылок.")
+        return
+    
+    await message.answer(
+        "⏸ Прерванные рассылки:",
+        reply_markup=get_resume_keyboard([b.id for b in broadcasts])
+    )
+
+# Обработчик команды /scheduled
+@router.message(Command("scheduled"))
+async def cmd_scheduled(message: Message, session: AsyncSession):
+    broadcasts = await get_scheduled_broadcasts(session)
+    if not broadcasts:
+        await message.answer("Нет запланированных рассылок.")
+        return
+    
+    response = "🕒 Запланированные рассылки:\n\n"
+    for b in broadcasts:
+        response += f"#{b.id} - {format_local(b.scheduled_at)}: {b.message_text[:50]}\n"
+    await message.answer(response, reply_markup=get_scheduled_keyboard([b.id for b in broadcasts]))
+
+# Обработчик команды /help
+@router.message(Command("help"))
+async def cmd_help(message: Message):
+    await message.answer(
+        "📚 Справка по использованию бота:\n\n"
+        "/broadcast [сегмент] - Начать рассылку\n"
+        "/stats - Просмотр статистики рассылок\n"
+        "/messages - Просмотр сообщений от пользователей\n"
+        "/search текст - Поиск по сообщениям пользователей\n"
+        "/clear_stats - Очистить статистику\n"
+        "/resume - Продолжить прерванные рассылки\n"
+        "/scheduled - Запланированные рассылки\n"
+        "/help - Показать это сообщение\n\n"
+        "Для ответа на сообщение используйте кнопку 'Ответить' под сообщением\n\n"
+        f"{SEGMENT_HELP}\n\n"
+        f"{SCHEDULE_HELP}"
+    )
+
+# Обработчик кнопки "Ответить"
+@router.callback_query(F.data.startswith("reply_"))
+async def process_reply(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    try:
+        message_id = int(callback.data.split("_")[1])
+    except (ValueError, IndexError) as e:
+        logging.error(f"Ошибка при обработке callback: {e}")
+        await callback.message.edit_text("Ошибка при обработке запроса.")
+        return
+    
+    user_message = await get_user_message(session, message_id)
+    if not user_message:
+        await callback.message.edit_text("Сообщение не найдено.")
+        return
+    
+    user = user_message.user
+    # Отдельное сообщение, чтобы не затирать страницу входящих
+    await callback.message.answer(
+        f"Отправьте ответ пользователю @{user.username or 'Без username'}"
+    )
+    await callback.answer()
+    await state.set_state(AdminStates.waiting_for_reply)
+    # update_data: запросы поиска нужны кнопкам уже показанных результатов
+    await state.update_data(user_id=user.user_id, message_id=message_id)
+
+# Обработчик кнопки "Удалить"
+@router.callback_query(F.data.startswith("delete_"))
+async def process_delete(callback: CallbackQuery, session: AsyncSession):
+    try:
+        message_id = int(callback.data.split("_")[1])
+    except (ValueError, IndexError) as e:
+        logging.error(f"Ошибка при обработке callback: {e}")
+        await callback.message.edit_text("Ошибка при обработке запроса.")
+        return
+    
+    try:
+        deleted = await delete_user_message(session, message_id)
+    except Exception as e:
+        logging.error(f"Ошибка при удалении сообщения: {e}")
+        await session.rollback()
+        await callback.message.edit_text("❌ Ошибка при удалении сообщения.")
+        return
+    
+    if not deleted:
+        await callback.message.edit_text("Сообщение не найдено.")
+        return
+    
+    await callback.message.edit_text("✅ Сообщение успешно удалено!")
+
+# Навигация по входящим сообщениям
+@router.callback_query(F.data.startswith(("inbox_", "inboxprev_", "inboxread_", "inboxdel_")))
+async def process_inbox(callback: CallbackQuery, session: AsyncSession):
+    try:
+        action, *ids = callback.data.split("_")
+        ids = [int(value) for value in ids]
+    except ValueError as e:
+        logging.error(f"Ошибка при обработке callback: {e}")
+        await callback.message.edit_text("Ошибка при обработке запроса.")
+        return
+    
+    if action == "inboxprev":
+        page = await load_inbox_page(session, before_id=ids[0]) or await load_inbox_page(session)
+    elif action == "inboxread":
+        await mark_messages_as_read(session, ids[0], ids[1])
+        page = await load_inbox_page(session)
+    elif action == "inboxdel":
+        await delete_user_message(session, ids[0])
+        page = await load_inbox_page(session, after_id=ids[1]) or await load_inbox_page(session)
+    else:
+        page = await load_inbox_page(session, after_id=ids[0])
+    
+    if not page:
+        await callback.message.edit_text("✅ Новых сообщений нет.")
+        return
+    
+    text, keyboard = page
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+# Навигация по результатам поиска и удаление найденного сообщения
+@router.callback_query(F.data.startswith(("search_", "searchdel_")))
+async def process_search(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    try:
+        action, *ids = callback.data.split("_")
+        ids = [int(value) for value in ids]
+    except ValueError as e:
+        logging.error(f"Ошибка при обработке callback: {e}")
+        await callback.message.edit_text("Ошибка при обработке запроса.")
+        return
+    
+    queries = (await state.get_data()).get("search_queries", {})
+    query = queries.get(str(callback.message.message_id))
+    if not query:
+        await callback.message.edit_text("Результаты поиска устарели - повторите /search.")
+        return
+    
+    if action == "searchdel":
+        await delete_user_message(session, ids[0])
+    page_number = ids[-1]
+    page = await load_search_page(session, query, page_number)
+    # После удаления последнего результата страницы показываем предыдущую
+    if page and page[1] is None and page_number > 0:
+        page = await load_search_page(session, query, page_number - 1)
+    if page is None:
+        await callback.message.edit_text("Поиск недоступен: SQLite собран без FTS5.")
+        return
+    
+    text, keyboard = page
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+# Просмотр диалога
+@router.callback_query(F.data.startswith("dialog_"))
+async def process_dialog(callback: CallbackQuery, session: AsyncSession):
+    try:
+        parts = callback.data.split("_")
+        message_id = int(parts[1])
+        after_id = int(parts[2]) if len(parts) > 2 else 0
+    except (ValueError, IndexError) as e:
+        logging.error(f"Ошибка при обработке callback: {e}")
+        await callback.message.edit_text("Ошибка при обработке запроса.")
+        return
+    
+    page_size = config.DIALOG_PAGE_SIZE
+    # Берем на одно сообщение больше, чтобы узнать, есть ли следующая страница
+    messages = await get_dialog(session, message_id, after_id, page_size + 1)
+    
+    if not messages:
+        await callback.message.edit_text("Диалог не найден.")
+        return
+    
+    has_more = len(messages) > page_size
+    messages = messages[:page_size]
+    user_messages = [m for m in messages if not m['is_admin']]
+    reply_to = user_messages[-1]['id'] if user_messages else message_id
+    await callback.message.edit_text(
+        format_dialog(messages),
+        reply_markup=get_dialog_keyboard(
+            message_id,
+            reply_to,
+            messages[-1]['id'] if has_more else None
+        )
+    )
+
+# Удаление диалога
+@router.callback_query(F.data.startswith("deldialog_"))
+async def process_delete_dialog(callback: CallbackQuery, session: AsyncSession):
+    try:
+        message_id = int(callback.data.split("_")[1])
+    except (ValueError, IndexError) as e:
+        logging.error(f"Ошибка при обработке callback: {e}")
+        await callback.message.edit_text("Ошибка при обработке запроса.")
+        return
+    
+    if await delete_dialog(session, message_id):
+        await callback.message.edit_text("✅ Диалог успешно удален!")
+    else:
+        await callback.message.edit_text("Диалог не найден.")
+
+# Выбор готового сегмента рассылки
+@router.callback_query(F.data.startswith("segment_"))
+async def process_segment(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    preset = SEGMENT_PRESETS.get(callback.data[len("segment_"):])
+    if not preset:
+        await callback.answer("Неизвестный сегмент.")
+        return
+    if await state.get_state() != AdminStates.waiting_for_broadcast.state:
+        await callback.answer("Рассылка уже отправлена - начните новую командой /broadcast.")
+        return
+    
+    segment = parse_segment(preset[1])
+    data = await state.update_data(segment=segment)
+    text = await format_broadcast_prompt(session, segment, data.get("schedule"))
+    # Повторное нажатие той же кнопки не меняет текст - Telegram отклонил бы правку
+    if text != callback.message.text:
+        await callback.message.edit_text(text, reply_markup=get_segment_keyboard())
+    await callback.answer()
+
+# Отмена отложенной рассылки
+@router.callback_query(F.data.startswith("unschedule_"))
+async def process_unschedule(callback: CallbackQuery, session: AsyncSession):
+    try:
+        broadcast_id = int(callback.data.split("_")[1])
+    except (ValueError, IndexError) as e:
+        logging.error(f"Ошибка при обработке callback: {e}")
+        await callback.answer("Ошибка при обработке запроса.")
+        return
+    
+    if await cancel_scheduled_broadcast(session, broadcast_id):
+        await callback.message.edit_text(f"✖️ Рассылка #{broadcast_id} отменена.")
+    else:
+        await callback.message.edit_text(f"Рассылка #{broadcast_id} уже началась или отменена.")
+
+# Продолжение прерванной рассылки
+@router.callback_query(F.data.startswith("resume_"))
+async def process_resume(callback: CallbackQuery, bot: Bot, session: AsyncSession, tenant: BotTenant):
+    try:
+        broadcast_id = int(callback.data.split("_")[1])
+    except (ValueError, IndexError) as e:
+        logging.error(f"Ошибка при обработке callback: {e}")
+        await callback.message.edit_text("Ошибка при обработке запроса.")
+        return
+    
+    broadcast = await get_resumable_broadcast(session, broadcast_id)
+    if not broadcast or broadcast_jobs.get(bot, broadcast_id):
+        await callback.message.edit_text("Рассылка не найдена или уже выполняется.")
+        return
+    
+    if broadcast.status == "paused":
+        await set_broadcast_status(session, broadcast_id, "running")
+    await callback.message.edit_text(f"Продолжаю рассылку #{broadcast_id}...")
+    # Исходного объекта Message уже нет - копируем сообщение из чата администратора
+    await broadcast_jobs.submit(
+        bot, broadcast_id, copy_sender(bot, broadcast), callback.message.chat.id,
+        tenant.session_factory, tenant.broadcaster
+    )
+
+# Пауза, продолжение и отмена фоновой рассылки
+@router.callback_query(F.data.startswith(("bcpause_", "bccontinue_", "bccancel_")))
+async def process_broadcast_control(callback: CallbackQuery, bot: Bot):
+    try:
+        action, broadcast_id = callback.data.split("_")
+        broadcast_id = int(broadcast_id)
+    except ValueError as e:
+        logging.error(f"Ошибка при обработке callback: {e}")
+        await callback.answer("Ошибка при обработке запроса.")
+        return
+    
+    if action == "bcpause":
+        done = await broadcast_jobs.pause(bot, broadcast_id)
+    elif action == "bccontinue":
+        done = await broadcast_jobs.resume(bot, broadcast_id)
+    else:
+        done = await broadcast_jobs.cancel(bot, broadcast_id)
+    await callback.answer(None if done else "Рассылка уже завершена.")
+
+# Навигация по статистике
+@router.callback_query(F.data.startswith("stats_"))
+async def process_stats_page(callback: CallbackQuery, session: AsyncSession):
+    try:
+        _, days, direction, broadcast_id = callback.data.split("_")
+        days, broadcast_id = int(days), int(broadcast_id)
+    except ValueError as e:
+        logging.error(f"Ошибка при обработке callback: {e}")
+        await callback.message.edit_text("Ошибка при обработке запроса.")
+        return
+    
+    if direction == "new":
+        page = await load_stats_page(session, days, after_id=broadcast_id)
+    else:
+        page = await load_stats_page(session, days, before_id=broadcast_id)
+    page = page or await load_stats_page(session, days)
+    
+    if not page:
+        await callback.message.edit_text("Пока нет статистики рассылок.")
+        return
+    
+    text, keyboard = page
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+# Очистка статистики
+@router.callback_query(F.data == "clear_stats")
+async def process_clear_stats(callback: CallbackQuery, session: AsyncSession):
+    if await clear_broadcast_stats(session):
+        await callback.message.edit_text("✅ Статистика успешно очищена!")
+    else:
+        await callback.message.edit_text("❌ Ошибка при очистке статистики.")
+
+# Обработчик сообщения для рассылки
+@router.message(AdminStates.waiting_for_broadcast)
+async def handle_broadcast_message(
+    message: Message,
+    state: FSMContext,
+    bot: Bot,
+    session: AsyncSession,
+    tenant: BotTenant,
+    album: Optional[List[Message]] = None
+):
+    data = await finish_scenario(state)
+    broadcast = await create_broadcast(session, message, album, data.get("segment"), data.get("schedule"))
+    if broadcast.status == "scheduled":
+        # Отложенную рассылку запустит планировщик (см. scheduler.py)
+        tenant.scheduler.wake()
+        await message.answer(
+            f"🕒 Рассылка #{broadcast.id} запланирована на {format_local(broadcast.scheduled_at)}.\n"
+            "Отменить ее можно командой /scheduled"
+        )
+        return
+    # Рассылка идет в фоне; ход и кнопки управления - в отдельном сообщении.
+    # Каждому получателю уходит одна копия сообщения или альбома
+    await broadcast_jobs.submit(
+        bot, broadcast.id, copy_sender(bot, broadcast), message.chat.id,
+        tenant.session_factory, tenant.broadcaster
+    )
+
+# Обработчик ответа администратора пользователю
+@router.message(AdminStates.waiting_for_reply)
+async def handle_reply_message(
+    message: Message,
+    state: FSMContext,
+    bot: Bot,
+    session: AsyncSession,
+    tenant: BotTenant,
+    album: Optional[List[Message]] = None
+):
+    data = await finish_scenario(state)
+    
+    try:
+        user = await get_user_by_id(session, data["user_id"])
+        
+        if not user:
+            await message.answer("Пользователь не найден.")
+            return
+        
+        # Отправляем ответ пользователю
+        success = await send_message_with_retry(
+            bot, user.user_id, message, album=album, broadcaster=tenant.broadcaster
+        )
+        if success:
+            # Сохраняем ответ в диалог и отмечаем исходное сообщение как прочитанное
+            await save_admin_reply(session, data["message_id"], message.text or message.caption or "Медиа-сообщение")
+            await message.answer("✅ Ответ успешно отправлен!")
+        else:
+            await message.answer("❌ Ошибка при отправке ответа. Попробуйте еще раз.")
+    except Exception as e:
+        logging.error(f"Ошибка при обработке ответа: {e}")
+        await session.rollback()
+        await message.answer("❌ Произошла ошибка при обработке ответа. Попробуйте еще раз.")
@@ -0,0 +1,51 @@
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.types import CallbackQuery, Message
+
+from filters import IsAdmin
+from middlewares import ThrottlingMiddleware
+from tenants import BotTenant
+
+# Обработчики обычных пользователей: без проверок состояний администратора
+router = Router(name="user")
+router.message.filter(~IsAdmin())
+router.callback_query.filter(~IsAdmin())
+# Лимит сообщений на пользователя; администратора фильтр роутера пропускает мимо
+router.message.middleware(ThrottlingMiddleware())
+
+
+# Обработчик команды /start
+@router.message(Command("start"))
+async def cmd_start(message: Message, tenant: BotTenant):
+    # Пользователь сохраняется в базу пакетом вместе с другими (см. writebehind.py)
+    await tenant.write_buffer.add_user(
+        message.from_user.id,
+        message.from_user.username,
+        message.from_user.first_name,
+        message.from_user.last_name
+    )
+    await message.answer(
+        "👋 Привет! Я бот для связи с администрацией.\n\n"
+        "Отправьте мне сообщение, и администратор ответит вам в ближайшее время."
+    )
+
+# Обработчик команды /help
+@router.message(Command("help"))
+async def cmd_help(message: Message):
+    await message.answer(
+        "📚 Справка по использованию бота:\n\n"
+        "Просто отправьте мне сообщение, и администратор ответит вам в ближайшее время."
+    )
+
+# Обработчик всех сообщений пользователя
+@router.message()
+async def handle_message(message: Message, tenant: BotTenant):
+    # Серия сообщений сохраняется одним сообщением, подтверждение - на первое (см. antiflood.py)
+    first = await tenant.flood_control.add_message(message.from_user.id, message.text or "Медиа-сообщение")
+    if first:
+        await message.answer("✅ Ваше сообщение получено! Администратор ответит вам в ближайшее время.")
+
+# Кнопки администратора недоступны пользователям
+@router.callback_query()
+async def process_callback(callback: CallbackQuery):
+    await callback.answer("У вас нет прав для этого действия.")
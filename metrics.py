@@ -0,0 +1,357 @@
+import bisect
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import config
+
+# Метрики хранятся в памяти процесса и отдаются в текстовом формате Prometheus.
+# Отдельная библиотека не нужна: используются только счетчики, значения
+# и гистограммы с метками.
+
+LabelValues = Tuple[str, ...]
+
+# Границы гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Границы гистограммы количества запросов к базе на обновление
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Метрика с метками"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        """Строки значений в текстовом формате"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    """Значение, которое может расти и уменьшаться"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def remove(self, **labels: str) -> None:
+        """Удаление ряда (например, завершенной рассылки)"""
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счетчики корзин, сумма и количество
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, totals = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def count(self, **labels: str) -> int:
+        item = self._values.get(self._key(labels))
+        return int(item[1][1]) if item else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = [(key, list(counts), list(totals)) for key, (counts, totals) in self._values.items()]
+        for key, counts, (total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {int(count)}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+# Обработчики
+UPDATES = REGISTRY.register(Counter(
+    "bot_updates_total", "Обработанные обновления", ["handler"]))
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "bot_handler_seconds", "Время работы обработчика", ["handler"]))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ["handler"]))
+UPDATE_SECONDS = REGISTRY.register(Histogram(
+    "bot_update_seconds", "Полное время обработки обновления с middleware", ["handler"]))
+
+# База данных
+DB_QUERIES = REGISTRY.register(Counter(
+    "bot_db_queries_total", "Запросы к базе данных"))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "bot_db_query_seconds", "Время одного запроса к базе данных"))
+UPDATE_DB_QUERIES = REGISTRY.register(Histogram(
+    "bot_update_db_queries", "Запросов к базе на одно обновление", ["handler"], QUERY_COUNT_BUCKETS))
+UPDATE_DB_SECONDS = REGISTRY.register(Histogram(
+    "bot_update_db_seconds", "Время запросов к базе на одно обновление", ["handler"]))
+
+# Запросы к Bot API
+API_SECONDS = REGISTRY.register(Histogram(
+    "bot_api_request_seconds", "Время запроса к Bot API", ["method"]))
+API_ERRORS = REGISTRY.register(Counter(
+    "bot_api_errors_total", "Ошибки Bot API по кодам", ["method", "code"]))
+
+# Входящие сообщения
+THROTTLED_MESSAGES = REGISTRY.register(Counter(
+    "bot_throttled_messages_total", "Сообщения пользователей, отброшенные антифлудом"))
+COALESCED_MESSAGES = REGISTRY.register(Counter(
+    "bot_coalesced_messages_total", "Сообщения, объединенные с предыдущим сообщением пользователя"))
+
+# Хранение истории
+ARCHIVED_ROWS = REGISTRY.register(Counter(
+    "bot_archived_rows_total", "Записи, перенесенные из базы в архив", ["table"]))
+
+# Рассылки
+BROADCAST_MESSAGES = REGISTRY.register(Counter(
+    "bot_broadcast_messages_total", "Результаты доставки рассылок", ["result"]))
+BROADCAST_QUEUE = REGISTRY.register(Gauge(
+    "bot_broadcast_queue_depth", "Получатели в очереди отправки", ["broadcast"]))
+BROADCAST_RATE = REGISTRY.register(Gauge(
+    "bot_broadcast_messages_per_second", "Средняя скорость рассылки", ["broadcast"]))
+BROADCAST_REMAINING = REGISTRY.register(Gauge(
+    "bot_broadcast_remaining", "Получатели, которым рассылка еще не отправлена", ["broadcast"]))
+BROADCAST_ETA = REGISTRY.register(Gauge(
+    "bot_broadcast_eta_seconds", "Оценка времени до завершения рассылки", ["broadcast"]))
+
+
+class UpdateStats:
+    """Статистика обработки одного обновления"""
+
+    def __init__(self, update_id: Optional[int] = None):
+        self.update_id = update_id
+        self.handler = "unhandled"
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+
+# Статистика текущего обновления; запросы к базе учитываются в ней
+current_update: contextvars.ContextVar[Optional[UpdateStats]] = contextvars.ContextVar(
+    "current_update", default=None
+)
+
+# Функции, которые вызываются со статистикой каждого обработанного обновления
+UpdateHook = Callable[[UpdateStats], None]
+update_hooks: List[UpdateHook] = []
+
+
+def run_update_hooks(stats: UpdateStats) -> None:
+    """Вызов зарегистрированных хуков; ошибка хука не влияет на обработку"""
+    for hook in update_hooks:
+        try:
+            hook(stats)
+        except Exception as e:
+            logging.error(f"Ошибка в хуке метрик {hook!r}: {e}")
+
+
+def log_slow_update(threshold: float) -> UpdateHook:
+    """Хук, который пишет в журнал обновления дольше threshold секунд"""
+    def hook(stats: UpdateStats) -> None:
+        if stats.seconds >= threshold:
+            logging.warning(
+                f"Медленное обновление {stats.update_id}: {stats.handler} "
+                f"{stats.seconds * 1000:.0f} мс, запросов к базе {stats.db_queries} "
+                f"({stats.db_seconds * 1000:.0f} мс)"
+            )
+    return hook
+
+
+class UpdateProfiler:
+    """Выборочное профилирование обновлений через cProfile
+
+    Профиль снимается для доли sample_rate обновлений и сохраняется в
+    directory как <обработчик>-<update_id>.prof (смотреть: python -m pstats).
+    Профилировщик видит весь поток, поэтому одновременно снимается
+    только один профиль, а в него попадают и параллельные обновления.
+    """
+
+    def __init__(self, directory: str, sample_rate: float = 0.01):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self._active: Optional[cProfile.Profile] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self) -> Optional[cProfile.Profile]:
+        if self._active is not None or random.random() >= self.sample_rate:
+            return None
+        self._active = cProfile.Profile()
+        self._active.enable()
+        return self._active
+
+    def stop(self, profile: Optional[cProfile.Profile], stats: UpdateStats) -> None:
+        if profile is None:
+            return
+        profile.disable()
+        self._active = None
+        profile.dump_stats(os.path.join(self.directory, f"{stats.handler}-{stats.update_id}.prof"))
+
+
+def create_profiler() -> Optional[UpdateProfiler]:
+    """Профилировщик по настройкам PROFILE_DIR и PROFILE_SAMPLE_RATE"""
+    if not config.PROFILE_DIR or config.PROFILE_SAMPLE_RATE <= 0:
+        return None
+    return UpdateProfiler(config.PROFILE_DIR, config.PROFILE_SAMPLE_RATE)
+
+
+if config.PROFILE_SLOW_MS > 0:
+    update_hooks.append(log_slow_update(config.PROFILE_SLOW_MS / 1000))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    seconds = time.perf_counter() - started
+    DB_QUERIES.inc()
+    DB_QUERY_SECONDS.observe(seconds)
+    stats = current_update.get()
+    if stats is not None:
+        stats.db_queries += 1
+        stats.db_seconds += seconds
+
+
+def _handle_error(context):
+    # Запрос завершился ошибкой - after_cursor_execute не будет вызван
+    stack = context.connection.info.get("query_started") if context.connection is not None else None
+    if stack:
+        stack.pop()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Учет количества и времени запросов движка SQLAlchemy"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Страница метрик в текстовом формате Prometheus"""
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+async def start_metrics_server(
+    host: str = config.METRICS_HOST,
+    port: int = config.METRICS_PORT
+) -> web.AppRunner:
+    """Запуск отдельного HTTP-сервера с метриками"""
+    app = web.Application()
+    app.router.add_get(config.METRICS_PATH, metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Метрики доступны на {host}:{port}{config.METRICS_PATH}")
+    return runner
@@ -0,0 +1,239 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramConflictError,
+    TelegramEntityTooLarge,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+    TelegramUnauthorizedError
+)
+from aiogram.methods import TelegramMethod
+from aiogram.types import Message, TelegramObject, Update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import config
+import metrics
+from antiflood import FloodControl
+from filters import IsAdmin
+from tenants import BotTenant
+
+# Код ошибки Bot API для метрик по типу исключения aiogram
+API_ERROR_CODES = (
+    (TelegramRetryAfter, "429"),
+    (TelegramForbiddenError, "403"),
+    (TelegramNotFound, "404"),
+    (TelegramBadRequest, "400"),
+    (TelegramUnauthorizedError, "401"),
+    (TelegramConflictError, "409"),
+    (TelegramEntityTooLarge, "413"),
+    (TelegramServerError, "5xx"),
+    (TelegramNetworkError, "network"),
+)
+
+
+class TenantMiddleware(BaseMiddleware):
+    """Бот процесса, которому пришло обновление (см. tenants.py)
+
+    Передается обработчикам аргументом tenant; регистрируется раньше
+    DbSessionMiddleware, чтобы сессия открывалась в базе этого бота.
+    """
+
+    def __init__(self, tenants: Iterable[BotTenant]):
+        self.tenants: Dict[int, BotTenant] = {tenant.bot.id: tenant for tenant in tenants}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        data["tenant"] = self.tenants[data["bot"].id]
+        return await handler(event, data)
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Одна сессия базы данных из пула на обновление
+
+    Сессия передается обработчику аргументом session. После обработчика
+    изменения фиксируются, при исключении - откатываются; соединение
+    возвращается в пул в любом случае. Если обновление пришло одному
+    из ботов процесса (TenantMiddleware), сессия открывается в его базе,
+    иначе - через session_factory.
+    """
+
+    def __init__(self, session_factory: Optional[async_sessionmaker] = None):
+        self.session_factory = session_factory
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        tenant = data.get("tenant")
+        session_factory = tenant.session_factory if tenant else self.session_factory
+        async with session_factory() as session:
+            data["session"] = session
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            await session.commit()
+            return result
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """Сбор сообщений альбома (media group) администратора в одно событие
+
+    Telegram присылает каждое фото альбома отдельным обновлением. Первое
+    обновление ждет остальные latency секунд, они добавляются к нему и дальше
+    не передаются. Обработчик вызывается один раз и получает весь альбом
+    аргументом album. Альбомы нужны только рассылкам и ответам администратора,
+    поэтому сообщения остальных пользователей не задерживаются.
+    Регистрируется на dp.update после TenantMiddleware (администратор у каждого
+    бота свой) и раньше DbSessionMiddleware, чтобы ожидание альбома
+    не занимало соединение из пула.
+    """
+
+    def __init__(self, latency: float = config.ALBUM_LATENCY, admin_filter: Optional[IsAdmin] = None):
+        self.latency = latency
+        self.admin_filter = admin_filter or IsAdmin()
+        self._albums: Dict[str, List[Update]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        message = event.message
+        if (message is None or not message.media_group_id
+                or not await self.admin_filter(message, data.get("tenant"))):
+            return await handler(event, data)
+        album = self._albums.get(message.media_group_id)
+        if album is not None:
+            album.append(event)
+            return None
+        album = self._albums[message.media_group_id] = [event]
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            del self._albums[message.media_group_id]
+        # Обновления альбома могут прийти не по порядку
+        album.sort(key=lambda update: update.message.message_id)
+        data["album"] = [update.message for update in album]
+        return await handler(album[0], data)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничение частоты сообщений пользователя (см. antiflood.py)
+
+    Сообщения сверх лимита не обрабатываются; о превышении пользователь
+    узнает не чаще раза за окно, чтобы не тратить на него лимит Bot API.
+    У каждого бота процесса (TenantMiddleware) свой антифлуд; flood_control
+    используется для обновлений без бота процесса.
+    """
+
+    def __init__(self, flood_control: Optional[FloodControl] = None):
+        self.flood_control = flood_control
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        user_id = event.from_user.id
+        tenant = data.get("tenant")
+        flood_control = tenant.flood_control if tenant else self.flood_control
+        if flood_control.allow(user_id):
+            return await handler(event, data)
+        if flood_control.should_warn(user_id):
+            await event.answer("⏳ Слишком много сообщений. Подождите немного, прежде чем писать снова.")
+        return None
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Время обработки обновления и запросы к базе за это время
+
+    Регистрируется первым, чтобы учитывать и фиксацию сессии в DbSessionMiddleware.
+    """
+
+    def __init__(self, profiler: Optional[metrics.UpdateProfiler] = None):
+        self.profiler = profiler
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        stats = metrics.UpdateStats(event.update_id if isinstance(event, Update) else None)
+        token = metrics.current_update.set(stats)
+        profile = self.profiler.start() if self.profiler else None
+        try:
+            return await handler(event, data)
+        finally:
+            stats.seconds = time.perf_counter() - stats.started
+            metrics.current_update.reset(token)
+            if self.profiler:
+                self.profiler.stop(profile, stats)
+            metrics.UPDATES.inc(handler=stats.handler)
+            metrics.UPDATE_SECONDS.observe(stats.seconds, handler=stats.handler)
+            metrics.UPDATE_DB_QUERIES.observe(stats.db_queries, handler=stats.handler)
+            metrics.UPDATE_DB_SECONDS.observe(stats.db_seconds, handler=stats.handler)
+            metrics.run_update_hooks(stats)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время работы и ошибки конкретного обработчика"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        stats = metrics.current_update.get()
+        if stats is not None:
+            stats.handler = name
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            metrics.HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время запросов к Bot API и коды ошибок"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Any:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            code = next((code for error, code in API_ERROR_CODES if isinstance(e, error)), "other")
+            metrics.API_ERRORS.inc(method=name, code=code)
+            raise
+        finally:
+            metrics.API_SECONDS.observe(time.perf_counter() - started, method=name)
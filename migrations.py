@@ -0,0 +1,260 @@
+import logging
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database import (
+    Base,
+    Broadcast,
+    BroadcastDailyStats,
+    BroadcastDelivery,
+    ConversationState,
+    User,
+    UserMessage,
+    default_database
+)
+
+# Версия схемы хранится в PRAGMA user_version самой базы.
+# Миграции идемпотентны: они проверяют текущую структуру перед изменением,
+# поэтому одинаково работают и на новой, и на старой "живой" базе.
+
+
+def _column_exists(conn: Connection, table: str, column: str) -> bool:
+    """Проверка наличия колонки в таблице"""
+    rows = conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()
+    return any(row[1] == column for row in rows)
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str) -> None:
+    """Добавление колонки, если ее еще нет"""
+    if not _column_exists(conn, table, column):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _create_indexes(conn: Connection, model, *names: str) -> None:
+    """Создание индексов, описанных в модели, по их именам"""
+    # Имена перечисляются явно: более поздние индексы модели могут
+    # ссылаться на колонки, которых на этой версии схемы еще нет
+    indexes = {index.name: index for index in model.__table__.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+def _initial_schema(conn: Connection) -> None:
+    """Создание отсутствующих таблиц"""
+    Base.metadata.create_all(conn)
+
+
+def _broadcast_resume_columns(conn: Connection) -> None:
+    """Колонки для возобновления рассылок и учета причин ошибок"""
+    _add_column(conn, "broadcasts", "source_chat_id", "INTEGER")
+    _add_column(conn, "broadcasts", "source_message_id", "INTEGER")
+    _add_column(conn, "broadcasts", "status", "VARCHAR")
+    _add_column(conn, "broadcasts", "last_user_id", "INTEGER DEFAULT 0")
+    _add_column(conn, "broadcasts", "failure_reasons", "JSON")
+    # Старые рассылки нельзя возобновить: исходное сообщение не сохранялось
+    conn.exec_driver_sql("UPDATE broadcasts SET status = 'completed' WHERE status IS NULL")
+    BroadcastDelivery.__table__.create(conn, checkfirst=True)
+
+
+def _dialog_columns(conn: Connection) -> None:
+    """Колонки диалогов, которые ожидают get_dialog/delete_dialog"""
+    _add_column(
+        conn,
+        "user_messages",
+        "parent_id",
+        "INTEGER REFERENCES user_messages(id) ON DELETE SET NULL"
+    )
+    _add_column(conn, "user_messages", "is_admin", "BOOLEAN DEFAULT 0")
+
+
+def _hot_column_indexes(conn: Connection) -> None:
+    """Индексы по часто фильтруемым колонкам"""
+    _create_indexes(conn, User, "ix_users_is_active_id")
+    _create_indexes(conn, Broadcast, "ix_broadcasts_created_at")
+    _create_indexes(
+        conn,
+        UserMessage,
+        "ix_user_messages_is_read_id",
+        "ix_user_messages_created_at",
+        "ix_user_messages_user_id",
+        "ix_user_messages_parent_id"
+    )
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _dialog_threads(conn: Connection) -> None:
+    """Денормализованный thread_id для выборки диалога одним запросом"""
+    _add_column(conn, "user_messages", "thread_id", "INTEGER")
+    # Корень диалога для существующих сообщений находим по цепочке parent_id
+    conn.exec_driver_sql("""
+        WITH RECURSIVE chain(id, root_id) AS (
+            SELECT id, id FROM user_messages WHERE parent_id IS NULL
+            UNION ALL
+            SELECT m.id, chain.root_id
+            FROM user_messages m JOIN chain ON m.parent_id = chain.id
+        )
+        UPDATE user_messages
+        SET thread_id = (SELECT root_id FROM chain WHERE chain.id = user_messages.id)
+        WHERE thread_id IS NULL
+    """)
+    # Сообщения с оборванной цепочкой становятся отдельными диалогами
+    conn.exec_driver_sql("UPDATE user_messages SET thread_id = id WHERE thread_id IS NULL")
+    _create_indexes(conn, UserMessage, "ix_user_messages_thread_id_id")
+
+
+def _broadcast_daily_stats(conn: Connection) -> None:
+    """Дневные сводки рассылок для мгновенной статистики"""
+    BroadcastDailyStats.__table__.create(conn, checkfirst=True)
+    conn.exec_driver_sql("""
+        INSERT OR REPLACE INTO broadcast_daily_stats (day, broadcasts, sent, failed, duration_seconds)
+        SELECT
+            date(created_at),
+            count(*),
+            coalesce(sum(sent_count), 0),
+            coalesce(sum(failed_count), 0),
+            coalesce(sum((julianday(completed_at) - julianday(created_at)) * 86400), 0)
+        FROM broadcasts
+        WHERE completed_at IS NOT NULL
+        GROUP BY date(created_at)
+    """)
+
+
+def _conversation_states(conn: Connection) -> None:
+    """Таблица состояний диалогов для FSM"""
+    ConversationState.__table__.create(conn, checkfirst=True)
+
+
+def _broadcast_albums(conn: Connection) -> None:
+    """Рассылка альбомов: ID всех сообщений исходной группы"""
+    _add_column(conn, "broadcasts", "source_message_ids", "JSON")
+
+
+def _user_segments(conn: Connection) -> None:
+    """Время активности пользователей и сегменты рассылок"""
+    _add_column(conn, "users", "last_seen", "DATETIME")
+    _add_column(conn, "broadcasts", "segment", "JSON")
+    # Активность существующих пользователей - по последнему сообщению или регистрации
+    conn.exec_driver_sql("""
+        UPDATE users
+        SET last_seen = coalesce(
+            (SELECT max(created_at) FROM user_messages WHERE user_messages.user_id = users.id),
+            created_at
+        )
+        WHERE last_seen IS NULL
+    """)
+    _create_indexes(conn, User, "ix_users_is_active_last_seen", "ix_users_is_active_created_at")
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _scheduled_broadcasts(conn: Connection) -> None:
+    """Отложенные рассылки с окном доставки и лимитом скорости"""
+    _add_column(conn, "broadcasts", "scheduled_at", "DATETIME")
+    _add_column(conn, "broadcasts", "deliver_until", "DATETIME")
+    _add_column(conn, "broadcasts", "max_rate", "FLOAT")
+    _create_indexes(conn, Broadcast, "ix_broadcasts_status_scheduled_at")
+
+
+def _message_search(conn: Connection) -> None:
+    """Полнотекстовый индекс FTS5 по сообщениям пользователей
+
+    Индекс хранит только токены (content=user_messages), тексты берутся из
+    самой таблицы. Триггеры поддерживают его при вставке, изменении текста
+    и удалении; ответы администратора не индексируются.
+    """
+    options = {row[0] for row in conn.exec_driver_sql("PRAGMA compile_options")}
+    if "ENABLE_FTS5" not in options:
+        logging.warning("SQLite собран без FTS5 - поиск по сообщениям (/search) недоступен")
+        return
+    conn.exec_driver_sql("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS user_messages_fts USING fts5(
+            message_text,
+            content='user_messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS user_messages_fts_insert
+        AFTER INSERT ON user_messages WHEN NOT coalesce(new.is_admin, 0) BEGIN
+            INSERT INTO user_messages_fts(rowid, message_text) VALUES (new.id, new.message_text);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS user_messages_fts_delete
+        AFTER DELETE ON user_messages WHEN NOT coalesce(old.is_admin, 0) BEGIN
+            INSERT INTO user_messages_fts(user_messages_fts, rowid, message_text)
+            VALUES ('delete', old.id, old.message_text);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS user_messages_fts_update
+        AFTER UPDATE OF message_text ON user_messages WHEN NOT coalesce(old.is_admin, 0) BEGIN
+            INSERT INTO user_messages_fts(user_messages_fts, rowid, message_text)
+            VALUES ('delete', old.id, old.message_text);
+            INSERT INTO user_messages_fts(rowid, message_text) VALUES (new.id, new.message_text);
+        END
+    """)
+    # Индексируем уже накопленные сообщения (rebuild проиндексировал бы и ответы администратора)
+    conn.exec_driver_sql("INSERT INTO user_messages_fts(user_messages_fts) VALUES ('delete-all')")
+    conn.exec_driver_sql("""
+        INSERT INTO user_messages_fts(rowid, message_text)
+        SELECT id, message_text FROM user_messages WHERE NOT coalesce(is_admin, 0)
+    """)
+    conn.exec_driver_sql("INSERT INTO user_messages_fts(user_messages_fts) VALUES ('optimize')")
+
+
+def _finished_broadcasts_completed_at(conn: Connection) -> None:
+    """Время завершения рассылок, отмененных до запуска
+
+    Раньше оно не записывалось, и такие рассылки не попадали в архив.
+    Точное время неизвестно - берем время создания.
+    """
+    conn.exec_driver_sql("""
+        UPDATE broadcasts SET completed_at = created_at
+        WHERE status IN ('completed', 'cancelled') AND completed_at IS NULL
+    """)
+
+
+# Список миграций: (версия, описание, функция)
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Начальная схема", _initial_schema),
+    (2, "Возобновляемые рассылки и причины ошибок", _broadcast_resume_columns),
+    (3, "Колонки диалогов parent_id и is_admin", _dialog_columns),
+    (4, "Индексы по горячим колонкам", _hot_column_indexes),
+    (5, "Диалоги с thread_id", _dialog_threads),
+    (6, "Дневные сводки рассылок", _broadcast_daily_stats),
+    (7, "Состояния диалогов", _conversation_states),
+    (8, "Рассылка альбомов", _broadcast_albums),
+    (9, "Сегменты рассылок и активность пользователей", _user_segments),
+    (10, "Отложенные рассылки", _scheduled_broadcasts),
+    (11, "Полнотекстовый поиск по сообщениям", _message_search),
+    (12, "Время завершения отмененных рассылок", _finished_broadcasts_completed_at),
+]
+
+
+def _get_version(conn: Connection) -> int:
+    """Текущая версия схемы базы"""
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def _migrate(conn: Connection) -> int:
+    """Применение всех миграций новее текущей версии"""
+    version = _get_version(conn)
+    for target, description, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        logging.info(f"Миграция базы данных до версии {target}: {description}")
+        migration(conn)
+        conn.exec_driver_sql(f"PRAGMA user_version = {target}")
+        version = target
+    return version
+
+
+async def run_migrations(engine: Optional[AsyncEngine] = None) -> int:
+    """Обновление схемы базы данных при запуске бота (по умолчанию - DATABASE_PATH)"""
+    if engine is None:
+        engine = default_database()[0]
+    async with engine.begin() as conn:
+        return await conn.run_sync(_migrate)
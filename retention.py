@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+import config
+import metrics
+from database import Broadcast, create_database
+from utils import (
+    delete_broadcasts,
+    delete_user_messages,
+    get_archivable_broadcasts,
+    get_archivable_messages,
+    purge_broadcast_deliveries
+)
+
+# Значение PRAGMA auto_vacuum для режима INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Неподдерживаемый тип для архива: {type(value).__name__}")
+
+
+def _append_archive(path: str, records: List[dict]) -> None:
+    """Дописывание записей в архив и сброс на диск
+
+    Каждый вызов добавляет в файл отдельный gzip-поток; gzip и zcat
+    читают такой файл как один JSONL.
+    """
+    lines = "".join(json.dumps(record, ensure_ascii=False, default=_json_default) + "\n" for record in records)
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="ab") as archive:
+            archive.write(lines.encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def _broadcast_record(broadcast: Broadcast) -> dict:
+    return {
+        "id": broadcast.id,
+        "message_text": broadcast.message_text,
+        "segment": broadcast.segment,
+        "scheduled_at": broadcast.scheduled_at,
+        "status": broadcast.status,
+        "sent_count": broadcast.sent_count,
+        "failed_count": broadcast.failed_count,
+        "failure_reasons": broadcast.failure_reasons,
+        "created_at": broadcast.created_at,
+        "completed_at": broadcast.completed_at
+    }
+
+
+async def get_auto_vacuum(engine: AsyncEngine) -> int:
+    """Текущее значение PRAGMA auto_vacuum базы"""
+    async with engine.connect() as conn:
+        return (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+
+
+async def enable_incremental_vacuum(engine: AsyncEngine) -> bool:
+    """Перевод базы в режим auto_vacuum=INCREMENTAL; False, если он уже включен
+
+    Режим существующей базы меняется только полным VACUUM: он переписывает
+    весь файл и блокирует запись, поэтому выполняется отдельной командой
+    при остановленном боте (python -m retention), а не при запуске.
+    Дальше освобожденные страницы возвращаются системе понемногу
+    через PRAGMA incremental_vacuum.
+    """
+    async with engine.connect() as conn:
+        # VACUUM не выполняется внутри транзакции
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        mode = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+        if mode == AUTO_VACUUM_INCREMENTAL:
+            return False
+        logging.info(f"Перестройка базы {engine.url.database} для incremental vacuum")
+        await conn.exec_driver_sql(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+        await conn.exec_driver_sql("VACUUM")
+    return True
+
+
+class DataRetention:
+    """Перенос старой истории из базы в архив
+
+    Прочитанные сообщения пользователей старше message_days и завершенные
+    рассылки старше broadcast_days раз в interval секунд дописываются в
+    файлы archive_dir/<таблица>-ГГГГ-ММ.jsonl.gz и удаляются из базы пакетами
+    по batch_size записей: каждый пакет - отдельная короткая транзакция,
+    которая не задерживает запись входящих сообщений. Пакет попадает в архив
+    и на диск до удаления, поэтому при сбое записи могут повториться в архиве,
+    но не потеряются. Журнал доставки рассылки в архив не переносится -
+    итоги рассылки сохраняются в ее записи и в дневной сводке /stats.
+    После переноса до vacuum_pages освободившихся страниц возвращаются системе.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        engine: AsyncEngine,
+        archive_dir: str = config.ARCHIVE_DIR,
+        message_days: float = config.MESSAGE_RETENTION_DAYS,
+        broadcast_days: float = config.BROADCAST_RETENTION_DAYS,
+        interval: float = config.RETENTION_INTERVAL,
+        batch_size: int = config.RETENTION_BATCH_SIZE,
+        vacuum_pages: int = config.VACUUM_PAGES
+    ):
+        self.session_factory = session_factory
+        self.engine = engine
+        self.archive_dir = archive_dir
+        self.message_days = message_days
+        self.broadcast_days = broadcast_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Режим auto_vacuum проверяется при первом сжатии
+        self._incremental: Optional[bool] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.message_days or self.broadcast_days)
+
+    async def _archive(self, table: str, records: List[dict]) -> None:
+        """Запись пакета в архивы по месяцам создания записей"""
+        months: Dict[str, List[dict]] = defaultdict(list)
+        for record in records:
+            months[record["created_at"].strftime("%Y-%m")].append(record)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        for month, month_records in months.items():
+            path = os.path.join(self.archive_dir, f"{table}-{month}.jsonl.gz")
+            # Сжатие и fsync - в отдельном потоке, чтобы не останавливать обработку обновлений
+            await asyncio.to_thread(_append_archive, path, month_records)
+        metrics.ARCHIVED_ROWS.inc(len(records), table=table)
+
+    async def archive_messages(self, before: datetime) -> int:
+        """Перенос прочитанных сообщений старше before; возвращает их количество"""
+        archived = 0
+        while not self._stop.is_set():
+            async with self.session_factory() as session:
+                records = await get_archivable_messages(session, before, self.batch_size)
+                if not records:
+                    return archived
+                await self._archive("user_messages", records)
+                await delete_user_messages(session, [record["id"] for record in records])
+            archived += len(records)
+            # Пакеты не идут подряд: между ними успевают другие запросы
+            await asyncio.sleep(0)
+        return archived
+
+    async def archive_broadcasts(self, before: datetime) -> int:
+        """Перенос рассылок, завершенных раньше before; возвращает их количество"""
+        archived = 0
+        while not self._stop.is_set():
+            async with self.session_factory() as session:
+                broadcasts = await get_archivable_broadcasts(session, before, self.batch_size)
+                if not broadcasts:
+                    return archived
+                # Журнал доставки может быть размером с аудиторию - удаляется частями
+                for broadcast in broadcasts:
+                    while await purge_broadcast_deliveries(session, broadcast.id, self.batch_size):
+                        if self._stop.is_set():
+                            return archived
+                        await asyncio.sleep(0)
+                await self._archive("broadcasts", [_broadcast_record(b) for b in broadcasts])
+                await delete_broadcasts(session, [b.id for b in broadcasts])
+            archived += len(broadcasts)
+            await asyncio.sleep(0)
+        return archived
+
+    async def vacuum(self) -> int:
+        """Возврат системе части свободных страниц базы; возвращает их количество
+
+        Без режима auto_vacuum=INCREMENTAL сжатие пропускается: полный VACUUM
+        автоматически не выполняется (см. enable_incremental_vacuum).
+        """
+        if not self.vacuum_pages:
+            return 0
+        if self._incremental is None:
+            self._incremental = await get_auto_vacuum(self.engine) == AUTO_VACUUM_INCREMENTAL
+            if not self._incremental:
+                logging.warning(
+                    f"База {self.engine.url.database} не в режиме auto_vacuum=INCREMENTAL: "
+                    f"файл базы не уменьшается. Перевести ее можно при остановленном боте: "
+                    f"python -m retention {self.engine.url.database}"
+                )
+        if not self._incremental:
+            return 0
+        async with self.engine.connect() as conn:
+            free = (await conn.exec_driver_sql("PRAGMA freelist_count")).scalar()
+            if not free:
+                return 0
+            await conn.commit()
+            # Прагма освобождает по странице на каждый шаг выполнения, а execute
+            # делает только один шаг; executescript выполняет ее до конца
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.executescript(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+            left = (await conn.exec_driver_sql("PRAGMA freelist_count")).scalar()
+        return free - left
+
+    async def run_once(self) -> dict:
+        """Один проход переноса и сжатия"""
+        now = datetime.utcnow()
+        result = {"messages": 0, "broadcasts": 0}
+        if self.message_days:
+            result["messages"] = await self.archive_messages(now - timedelta(days=self.message_days))
+        if self.broadcast_days:
+            result["broadcasts"] = await self.archive_broadcasts(now - timedelta(days=self.broadcast_days))
+        result["vacuumed_pages"] = await self.vacuum()
+        if result["messages"] or result["broadcasts"]:
+            logging.info(
+                f"Перенесено в архив: сообщений {result['messages']}, рассылок {result['broadcasts']}; "
+                f"освобождено страниц базы: {result['vacuumed_pages']}"
+            )
+        return result
+
+    async def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.exception(f"Ошибка переноса истории в архив: {e}")
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        """Запуск фонового переноса, если задан срок хранения"""
+        if not self.enabled or self._task is not None:
+            return
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Остановка фонового переноса после текущего пакета
+
+        Задача не отменяется: пакет, записанный в архив, должен быть удален из базы.
+        """
+        if self._task is not None:
+            self._stop.set()
+            await self._task
+            self._task = None
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Перевод баз в режим auto_vacuum=INCREMENTAL (выполнять при остановленном боте)"
+    )
+    parser.add_argument("databases", nargs="*", default=[config.DATABASE_PATH], help="файлы баз ботов")
+    args = parser.parse_args()
+    for path in args.databases:
+        engine, _ = create_database(path)
+        try:
+            if not await enable_incremental_vacuum(engine):
+                print(f"{path}: режим INCREMENTAL уже включен")
+        finally:
+            await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
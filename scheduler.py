@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from aiogram import Bot
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import config
+from broadcast_jobs import BroadcastJobs, broadcast_jobs
+from broadcaster import Broadcaster
+from utils import copy_sender, format_duration, get_scheduled_broadcasts, start_scheduled_broadcast
+
+SCHEDULE_HELP = (
+    "Время рассылки задается аргументами /broadcast:\n"
+    "at=18:30, at=2024-01-31T18:30 или at=+2h - время запуска\n"
+    "window=3h - растянуть отправку равномерно на 3 часа\n"
+    "rate=5 - отправлять не быстрее 5 сообщений в секунду"
+)
+
+# Длительность: число и единица (s, m, h, d)
+DURATION_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# Ключи аргументов /broadcast, которые относятся к расписанию
+SCHEDULE_KEYS = ("at", "window", "rate")
+
+
+def _local_now() -> datetime:
+    return datetime.utcnow() + timedelta(hours=config.TIMEZONE_OFFSET)
+
+
+def format_local(value: datetime) -> str:
+    """Время UTC из базы в часовом поясе администратора"""
+    return (value + timedelta(hours=config.TIMEZONE_OFFSET)).strftime("%d.%m.%Y %H:%M")
+
+
+def parse_duration(value: str) -> float:
+    """Длительность вида 30m или 2h в секундах"""
+    match = DURATION_PATTERN.match(value)
+    if not match:
+        raise ValueError
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def _parse_start(value: str, now: datetime) -> datetime:
+    """Время запуска по часам администратора; возвращается в UTC"""
+    if value.startswith("+"):
+        return datetime.utcnow() + timedelta(seconds=parse_duration(value[1:]))
+    if "T" in value:
+        local = datetime.strptime(value, "%Y-%m-%dT%H:%M")
+    else:
+        clock = datetime.strptime(value, "%H:%M")
+        local = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+        # Время, которое сегодня уже прошло, означает завтра
+        if local <= now:
+            local += timedelta(days=1)
+    return local - timedelta(hours=config.TIMEZONE_OFFSET)
+
+
+def parse_schedule(args: Optional[str]) -> Tuple[Optional[dict], str]:
+    """Расписание из аргументов /broadcast и оставшиеся аргументы (сегмент)
+
+    При ошибке в аргументах - ValueError.
+    """
+    now = _local_now()
+    schedule = {}
+    rest = []
+    for arg in (args or "").split():
+        key, _, value = arg.partition("=")
+        if key not in SCHEDULE_KEYS:
+            rest.append(arg)
+            continue
+        try:
+            if key == "at":
+                schedule["start_at"] = _parse_start(value, now).isoformat()
+            elif key == "window":
+                schedule["window"] = parse_duration(value)
+            else:
+                schedule["max_rate"] = float(value)
+                if schedule["max_rate"] <= 0:
+                    raise ValueError
+        except ValueError:
+            raise ValueError(f"Неверное время рассылки: {arg}") from None
+    return schedule or None, " ".join(rest)
+
+
+def describe_schedule(schedule: Optional[dict]) -> str:
+    """Описание расписания для администратора"""
+    if not schedule:
+        return "сразу"
+    parts = []
+    if "start_at" in schedule:
+        parts.append(f"в {format_local(datetime.fromisoformat(schedule['start_at']))}")
+    else:
+        parts.append("сразу")
+    if "window" in schedule:
+        parts.append(f"в течение {format_duration(schedule['window'])}")
+    if "max_rate" in schedule:
+        parts.append(f"не быстрее {schedule['max_rate']:g} сообщ./с")
+    return ", ".join(parts)
+
+
+class BroadcastScheduler:
+    """Запуск отложенных рассылок
+
+    Расписание хранится в таблице broadcasts, поэтому переживает перезапуск:
+    рассылки, время которых наступило, пока бот был остановлен, начинаются
+    сразу после запуска. Планировщик спит до ближайшей рассылки, но не дольше
+    interval секунд; новая рассылка будит его через wake(). Планировщик
+    у каждого бота свой (расписание - в его базе), а рассылки ставятся
+    в общую очередь jobs с его broadcaster.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        broadcaster: Broadcaster,
+        jobs: BroadcastJobs = broadcast_jobs,
+        interval: float = config.SCHEDULER_INTERVAL
+    ):
+        self.session_factory = session_factory
+        self.broadcaster = broadcaster
+        self.jobs = jobs
+        self.interval = interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self) -> None:
+        """Пересчитать время ближайшего запуска"""
+        self._wakeup.set()
+
+    async def run_due(self, bot: Bot) -> float:
+        """Запуск рассылок, которым пора начаться; возвращает паузу до следующей проверки"""
+        async with self.session_factory() as session:
+            now = datetime.utcnow()
+            for broadcast in await get_scheduled_broadcasts(session, due_before=now):
+                if not await start_scheduled_broadcast(session, broadcast.id):
+                    continue
+                logging.info(f"Запуск отложенной рассылки #{broadcast.id}")
+                # Ход рассылки показывается в чате, из которого ее создали
+                await self.jobs.submit(
+                    bot, broadcast.id, copy_sender(bot, broadcast), broadcast.source_chat_id,
+                    self.session_factory, self.broadcaster
+                )
+            upcoming = await get_scheduled_broadcasts(session)
+        if not upcoming:
+            return self.interval
+        delay = (upcoming[0].scheduled_at - datetime.utcnow()).total_seconds()
+        return min(max(delay, 0), self.interval)
+
+    async def _run(self, bot: Bot) -> None:
+        while True:
+            # Сброс до проверки: рассылка, созданная во время проверки, не потеряется
+            self._wakeup.clear()
+            try:
+                delay = await self.run_due(bot)
+            except Exception as e:
+                logging.exception(f"Ошибка планировщика рассылок: {e}")
+                delay = self.interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, bot: Bot) -> None:
+        """Запуск планировщика"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def close(self) -> None:
+        """Остановка планировщика; запланированные рассылки остаются в базе"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
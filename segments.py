@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import User
+
+# Готовые сегменты для кнопок /broadcast: ключ -> (подпись, аргументы команды)
+SEGMENT_PRESETS: Dict[str, Tuple[str, str]] = {
+    "all": ("Все", ""),
+    "active7": ("Активные за 7 дн.", "active=7"),
+    "active30": ("Активные за 30 дн.", "active=30"),
+    "new7": ("Новые за 7 дн.", "joined=7"),
+    "sample5": ("5% для проверки", "sample=5")
+}
+
+SEGMENT_HELP = (
+    "Сегмент задается аргументами /broadcast (условия объединяются через И):\n"
+    "active=7 - писали боту за последние 7 дней\n"
+    "joined=30 или joined=2024-01-31 - зарегистрировались за 30 дней или с даты\n"
+    "sample=5 - 5% пользователей (постоянная выборка для проверочной рассылки)\n"
+    "ids=123,456 - только указанные Telegram ID"
+)
+
+
+def _parse_since(value: str, now: datetime) -> datetime:
+    """Число дней назад или дата ГГГГ-ММ-ДД"""
+    if value.isdigit():
+        return now - timedelta(days=int(value))
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def parse_segment(args: Optional[str], now: Optional[datetime] = None) -> Optional[dict]:
+    """Сегмент из аргументов команды; None - все активные пользователи
+
+    Сроки переводятся в абсолютное время, чтобы продолженная рассылка шла
+    по той же аудитории. При ошибке в аргументах - ValueError.
+    """
+    now = now or datetime.utcnow()
+    segment = {}
+    for arg in (args or "").split():
+        key, _, value = arg.partition("=")
+        try:
+            if key == "active":
+                segment["active_since"] = _parse_since(value, now).isoformat()
+            elif key == "joined":
+                segment["joined_since"] = _parse_since(value, now).isoformat()
+            elif key == "sample":
+                percent = int(value)
+                if not 0 < percent <= 100:
+                    raise ValueError
+                segment["percent"] = percent
+            elif key == "ids":
+                segment["user_ids"] = sorted({int(user_id) for user_id in value.split(",")})
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"Неизвестное условие сегмента: {arg}") from None
+    return segment or None
+
+
+def segment_conditions(segment: Optional[dict]) -> list:
+    """Условия выборки получателей сегмента (кроме is_active)
+
+    Каждому условию соответствует индекс (is_active, колонка), поэтому
+    подсчет аудитории выполняется только по индексу.
+    """
+    if not segment:
+        return []
+    conditions = []
+    if "active_since" in segment:
+        conditions.append(User.last_seen >= datetime.fromisoformat(segment["active_since"]))
+    if "joined_since" in segment:
+        conditions.append(User.created_at >= datetime.fromisoformat(segment["joined_since"]))
+    if "percent" in segment:
+        # Выборка по users.id постоянна: повторная проверка идет тем же пользователям
+        conditions.append(User.id % 100 < segment["percent"])
+    if "user_ids" in segment:
+        conditions.append(User.user_id.in_(segment["user_ids"]))
+    return conditions
+
+
+def describe_segment(segment: Optional[dict]) -> str:
+    """Описание сегмента для администратора"""
+    if not segment:
+        return "все пользователи"
+    parts: List[str] = []
+    if "active_since" in segment:
+        parts.append(f"активны с {segment['active_since'][:10]}")
+    if "joined_since" in segment:
+        parts.append(f"зарегистрированы с {segment['joined_since'][:10]}")
+    if "percent" in segment:
+        parts.append(f"{segment['percent']}% выборка")
+    if "user_ids" in segment:
+        parts.append(f"{len(segment['user_ids'])} указанных ID")
+    return ", ".join(parts)
+
+
+async def count_audience(session: AsyncSession, segment: Optional[dict]) -> int:
+    """Количество активных получателей сегмента"""
+    return await session.scalar(
+        select(func.count())
+        .select_from(User)
+        .where(User.is_active == True, *segment_conditions(segment))
+    )
@@ -0,0 +1,246 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import delete, or_, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import config
+from database import ConversationState
+
+
+class AdminStates(StatesGroup):
+    """Состояния сценариев администратора"""
+    waiting_for_broadcast = State()
+    waiting_for_reply = State()
+
+
+class StateStore(ABC):
+    """Хранилище состояний диалогов с ограниченным временем жизни"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        """Получение значения или None, если его нет или оно истекло"""
+
+    @abstractmethod
+    async def set(self, key: str, value: dict, ttl: Optional[float] = None) -> None:
+        """Сохранение значения; ttl - время жизни в секундах"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Удаление значения"""
+
+    async def close(self) -> None:
+        """Освобождение ресурсов хранилища"""
+
+
+class MemoryStateStore(StateStore):
+    """Хранилище в памяти процесса с вытеснением давно неиспользуемых ключей"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    async def get(self, key: str) -> Optional[dict]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at is not None and expires_at <= time.time():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        self._items[key] = (expires_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    async def delete(self, key: str) -> None:
+        self._items.pop(key, None)
+
+
+class SQLiteStateStore(StateStore):
+    """Хранилище в таблице conversation_states основной базы"""
+
+    def __init__(self, session_factory: async_sessionmaker, purge_interval: float = 60):
+        self.session_factory = session_factory
+        self.purge_interval = purge_interval
+        self._purged_at = time.monotonic()
+
+    async def get(self, key: str) -> Optional[dict]:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(ConversationState.value).where(
+                    ConversationState.key == key,
+                    or_(ConversationState.expires_at.is_(None), ConversationState.expires_at > time.time())
+                )
+            )
+            return result.scalar()
+
+    async def set(self, key: str, value: dict, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        stmt = sqlite_insert(ConversationState).values(key=key, value=value, expires_at=expires_at)
+        async with self.session_factory() as session:
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[ConversationState.key],
+                    set_={"value": stmt.excluded.value, "expires_at": stmt.excluded.expires_at}
+                )
+            )
+            # Истекшие записи удаляем не чаще раза в purge_interval
+            if time.monotonic() - self._purged_at >= self.purge_interval:
+                self._purged_at = time.monotonic()
+                await session.execute(
+                    delete(ConversationState).where(ConversationState.expires_at <= time.time())
+                )
+            await session.commit()
+
+    async def delete(self, key: str) -> None:
+        async with self.session_factory() as session:
+            await session.execute(delete(ConversationState).where(ConversationState.key == key))
+            await session.commit()
+
+
+class RedisStateStore(StateStore):
+    """Хранилище на сервере с протоколом Redis
+
+    Вместо url можно передать готовый клиент (например, подключенный
+    к локальному тестовому серверу).
+    """
+
+    def __init__(self, url: Optional[str] = None, client: Any = None, prefix: str = "tgbot:"):
+        if client is None:
+            try:
+                from redis import asyncio as aioredis
+            except ImportError as e:
+                raise RuntimeError("Для STATE_BACKEND=redis установите пакет redis") from e
+            client = aioredis.from_url(url)
+        self._redis = client
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = await self._redis.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: dict, ttl: Optional[float] = None) -> None:
+        await self._redis.set(
+            self.prefix + key,
+            json.dumps(value),
+            px=int(ttl * 1000) if ttl else None
+        )
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(self.prefix + key)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+class StateStoreStorage(BaseStorage):
+    """FSM-хранилище aiogram поверх StateStore
+
+    Состояние и данные хранятся под разными ключами, чтобы их изменение
+    из нескольких процессов не перезаписывало друг друга.
+    Если задан only_users, состояния есть только у этих пользователей:
+    для остальных хранилище не опрашивается вовсе.
+    """
+
+    def __init__(
+        self,
+        store: StateStore,
+        ttl: Optional[float] = config.STATE_TTL,
+        only_users: Optional[Iterable[int]] = None
+    ):
+        self.store = store
+        self.ttl = ttl
+        self.only_users = frozenset(only_users) if only_users is not None else None
+
+    def _has_states(self, key: StorageKey) -> bool:
+        return self.only_users is None or key.user_id in self.only_users
+
+    @staticmethod
+    def _key(key: StorageKey, part: str) -> str:
+        parts = ["fsm", key.bot_id, key.chat_id, key.user_id, key.thread_id or "", key.destiny]
+        if key.business_connection_id:
+            parts.append(key.business_connection_id)
+        return ":".join(str(item) for item in parts) + f":{part}"
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            await self.store.delete(self._key(key, "state"))
+        else:
+            await self.store.set(self._key(key, "state"), {"state": state}, self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        if not self._has_states(key):
+            return None
+        value = await self.store.get(self._key(key, "state"))
+        return value["state"] if value else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not data:
+            await self.store.delete(self._key(key, "data"))
+        else:
+            await self.store.set(self._key(key, "data"), dict(data), self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        if not self._has_states(key):
+            return {}
+        return dict(await self.store.get(self._key(key, "data")) or {})
+
+    async def close(self) -> None:
+        await self.store.close()
+
+
+class PerBotStorage(BaseStorage):
+    """FSM-хранилище, у каждого бота процесса свое (см. tenants.py)
+
+    Ключ FSM содержит ID бота, по нему выбирается хранилище: так состояния
+    бота с STATE_BACKEND=sqlite пишутся в его собственную базу.
+    """
+
+    def __init__(self, storages: Mapping[int, BaseStorage]):
+        self.storages = dict(storages)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self.storages[key.bot_id].set_state(key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.storages[key.bot_id].get_state(key)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self.storages[key.bot_id].set_data(key, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return await self.storages[key.bot_id].get_data(key)
+
+    async def close(self) -> None:
+        for storage in self.storages.values():
+            await storage.close()
+
+
+def create_state_store(
+    session_factory: async_sessionmaker,
+    backend: str = config.STATE_BACKEND
+) -> StateStore:
+    """Создание хранилища состояний по настройке STATE_BACKEND
+
+    Для sqlite состояния хранятся в базе, к которой относится session_factory.
+    """
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "sqlite":
+        return SQLiteStateStore(session_factory)
+    if backend == "redis":
+        return RedisStateStore(config.REDIS_URL)
+    raise ValueError(f"Неизвестное хранилище состояний: {backend}")
@@ -0,0 +1,147 @@
+import json
+import os
+from typing import FrozenSet, List
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.utils.token import TokenValidationError
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+import config
+from antiflood import FloodControl
+from broadcaster import Broadcaster, create_broadcaster
+from database import create_database, default_database
+from retention import DataRetention
+from scheduler import BroadcastScheduler
+from writebehind import WriteBehindBuffer
+
+
+class BotTenant:
+    """Бот, которого обслуживает процесс, и его собственные компоненты
+
+    У каждого бота свои администратор и база, поэтому свои буфер записи,
+    антифлуд (он сбрасывает сообщения в буфер), планировщик, перенос истории
+    и хранилище состояний (states.PerBotStorage). Лимиты Telegram действуют
+    на токен, поэтому и ограничители скорости (broadcaster) у каждого бота
+    свои. HTTP-сессия Bot API, диспетчер с обработчиками и очередь рассылок
+    (broadcast_jobs.broadcast_jobs) общие для всех ботов процесса. Обработчики
+    получают бота, которому пришло обновление, аргументом tenant (см. middlewares.py).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        bot: Bot,
+        admin_id: int,
+        engine: AsyncEngine,
+        session_factory: async_sessionmaker,
+        broadcaster: Broadcaster,
+        write_buffer: WriteBehindBuffer,
+        flood_control: FloodControl,
+        scheduler: BroadcastScheduler,
+        retention: DataRetention
+    ):
+        self.name = name
+        self.bot = bot
+        self.admin_id = admin_id
+        self.admin_ids: FrozenSet[int] = frozenset((admin_id,))
+        self.engine = engine
+        self.session_factory = session_factory
+        self.broadcaster = broadcaster
+        self.write_buffer = write_buffer
+        self.flood_control = flood_control
+        self.scheduler = scheduler
+        self.retention = retention
+
+    async def start(self) -> None:
+        """Запуск фоновых задач бота"""
+        # Незакрытые окна антифлуда передаются в буфер до его последнего сброса
+        await self.flood_control.start()
+        await self.write_buffer.start()
+        await self.scheduler.start(self.bot)
+        await self.retention.start()
+
+    async def close(self) -> None:
+        """Остановка фоновых задач и запись оставшихся данных в базу"""
+        await self.flood_control.close()
+        await self.write_buffer.close()
+        await self.scheduler.close()
+        await self.retention.close()
+
+
+def _build_tenant(
+    name: str,
+    bot: Bot,
+    admin_id: int,
+    engine: AsyncEngine,
+    session_factory: async_sessionmaker,
+    broadcast_rate: float
+) -> BotTenant:
+    """Компоненты бота поверх его базы"""
+    bot_broadcaster = create_broadcaster(broadcast_rate, name)
+    bot_buffer = WriteBehindBuffer(session_factory)
+    return BotTenant(
+        name,
+        bot,
+        admin_id,
+        engine,
+        session_factory,
+        bot_broadcaster,
+        bot_buffer,
+        FloodControl(bot_buffer),
+        BroadcastScheduler(session_factory, bot_broadcaster),
+        # Архив каждого бота - в своем подкаталоге
+        DataRetention(session_factory, engine, archive_dir=os.path.join(config.ARCHIVE_DIR, name))
+    )
+
+
+def default_tenant(bot: Bot) -> BotTenant:
+    """Единственный бот процесса из BOT_TOKEN, ADMIN_ID и DATABASE_PATH"""
+    engine, session_factory = default_database()
+    return _build_tenant("", bot, config.ADMIN_ID, engine, session_factory, config.BROADCAST_RATE)
+
+
+def create_tenant(
+    name: str,
+    bot: Bot,
+    admin_id: int,
+    database: str,
+    broadcast_rate: float = config.BROADCAST_RATE
+) -> BotTenant:
+    """Бот с собственной базой и собственными экземплярами компонентов"""
+    engine, session_factory = create_database(database)
+    return _build_tenant(name, bot, admin_id, engine, session_factory, broadcast_rate)
+
+
+def load_tenants(session: BaseSession, path: str = config.BOTS_FILE) -> List[BotTenant]:
+    """Боты процесса: из файла BOTS_FILE или один бот из переменных окружения
+
+    Файл - JSON-список ботов:
+    [{"name": "club", "token": "...", "admin_id": 123, "database": "club.db", "broadcast_rate": 28}]
+    database (по умолчанию <name>.db) и broadcast_rate необязательны.
+    Все боты используют одну HTTP-сессию session. При ошибке в файле - ValueError.
+    """
+    if not path:
+        return [default_tenant(Bot(token=config.BOT_TOKEN, session=session))]
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    tenants = []
+    for number, entry in enumerate(entries, 1):
+        try:
+            name = entry["name"]
+            tenant = create_tenant(
+                name,
+                Bot(token=entry["token"], session=session),
+                int(entry["admin_id"]),
+                entry.get("database") or f"{name}.db",
+                float(entry.get("broadcast_rate", config.BROADCAST_RATE))
+            )
+        except (KeyError, TypeError, ValueError, TokenValidationError) as e:
+            # Само описание в сообщение не попадает: в нем токен
+            raise ValueError(f"Неверное описание бота №{number} в {path}: {e!r}") from None
+        tenants.append(tenant)
+    if not tenants:
+        raise ValueError(f"В {path} не описано ни одного бота")
+    if len({t.name for t in tenants}) < len(tenants) or len({t.bot.id for t in tenants}) < len(tenants):
+        raise ValueError(f"Имена и токены ботов в {path} должны быть уникальными")
+    return tenants
@@ -1,101 +1,687 @@
 from aiogram import Bot
 from aiogram.types import Message
-from database import Session, User, Broadcast, UserMessage
-from datetime import datetime
+from sqlalchemy import select, update, delete, exists, func, column, literal_column, table, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from database import User, Broadcast, BroadcastDailyStats, BroadcastDelivery, UserMessage
+from broadcaster import create_broadcaster, Broadcaster, BroadcastAborted, BroadcastControl, SendFunc, DEAD_CHAT_REASONS
+from segments import segment_conditions
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import asyncio
-from typing import Union, List
+import logging
+import re
+import time
+import config
+
+# Статусы завершенных рассылок: у них есть время завершения completed_at
+FINISHED_BROADCAST_STATUSES = ("completed", "cancelled", "failed")
+
+# Рассылки, которые выполняются в текущем процессе: (файл базы, ID рассылки)
+_active_broadcasts = set()
+
+# Полнотекстовый индекс сообщений пользователей (см. migrations._message_search)
+user_messages_fts = table("user_messages_fts", column("rowid"))
+
+def _active_key(session: AsyncSession, broadcast_id: int) -> Tuple[str, int]:
+    """Ключ рассылки в _active_broadcasts: у каждого бота процесса своя база и свои ID"""
+    return session.bind.url.database, broadcast_id
+
+def copy_messages_sender(bot: Bot, from_chat_id: int, message_ids: List[int]) -> SendFunc:
+    """Копирование сообщений в чат одним запросом к Bot API
+
+    copyMessage переносит любой тип сообщения вместе с подписью и разметкой,
+    а copyMessages сохраняет группировку альбома.
+    """
+    if len(message_ids) == 1:
+        return lambda chat_id: bot.copy_message(chat_id, from_chat_id, message_ids[0])
+    # copyMessages требует ID по возрастанию
+    message_ids = sorted(message_ids)
+    return lambda chat_id: bot.copy_messages(chat_id, from_chat_id, message_ids)
+
+def message_ids(message: Message, album: Optional[List[Message]] = None) -> List[int]:
+    """ID сообщения или всех сообщений альбома"""
+    return [m.message_id for m in album] if album else [message.message_id]
+
+async def send_message(
+    bot: Bot,
+    chat_id: int,
+    message: Message,
+    album: Optional[List[Message]] = None
+) -> None:
+    """Отправка копии сообщения (или альбома) в чат"""
+    await copy_messages_sender(bot, message.chat.id, message_ids(message, album))(chat_id)
 
 async def send_message_with_retry(
     bot: Bot,
     chat_id: int,
     message: Message,
-    max_retries: int = 3
+    max_retries: int = 3,
+    album: Optional[List[Message]] = None,
+    broadcaster: Optional[Broadcaster] = None
 ) -> bool:
-    """Отправка сообщения с повторными попытками"""
-    for attempt in range(max_retries):
+    """Отправка сообщения с повторными попытками (в пределах лимитов бота broadcaster)"""
+    if broadcaster is None:
+        broadcaster = create_broadcaster()
+    try:
+        reason = await broadcaster.deliver(
+            chat_id,
+            copy_messages_sender(bot, message.chat.id, message_ids(message, album)),
+            max_retries
+        )
+    except BroadcastAborted as e:
+        logging.error(f"Не удалось скопировать сообщение {message.message_id}: {e.reason}")
+        return False
+    return reason is None
+
+class DeliveryLedger:
+    """Журнал доставки рассылки с пакетной записью в базу"""
+
+    def __init__(
+        self,
+        session: AsyncSession,
+        broadcast: Broadcast,
+        batch_size: int = config.BROADCAST_BATCH_SIZE,
+        flush_interval: float = config.BROADCAST_FLUSH_INTERVAL
+    ):
+        self.session = session
+        self.broadcast = broadcast
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Сессия общая для выборки получателей и записи журнала
+        self._lock = asyncio.Lock()
+        self._in_flight = set()
+        self._last_streamed = broadcast.last_user_id or 0
+        self._buffer = []
+        self._failure_reasons = dict(broadcast.failure_reasons or {})
+        self._flushed_at = time.monotonic()
+
+    async def recipients(self) -> AsyncIterator[Tuple[int, int]]:
+        """Постраничная выборка необработанных получателей по users.id"""
+        already_sent = exists().where(
+            BroadcastDelivery.broadcast_id == self.broadcast.id,
+            BroadcastDelivery.user_id == User.id
+        )
+        segment = segment_conditions(self.broadcast.segment)
+        after_id = self.broadcast.last_user_id or 0
+        while True:
+            async with self._lock:
+                result = await self.session.execute(
+                    select(User.id, User.user_id)
+                    .where(User.is_active == True, User.id > after_id, ~already_sent, *segment)
+                    .order_by(User.id)
+                    .limit(self.batch_size)
+                )
+                page = result.all()
+            if not page:
+                return
+            for user_id, chat_id in page:
+                self._in_flight.add(user_id)
+                self._last_streamed = user_id
+                yield user_id, chat_id
+            after_id = page[-1].id
+
+    async def record(self, user_id: int, success: bool, reason: Optional[str] = None) -> None:
+        """Запись результата отправки одному получателю"""
+        self._in_flight.discard(user_id)
+        self._buffer.append({
+            "broadcast_id": self.broadcast.id,
+            "user_id": user_id,
+            "status": "sent" if success else "failed",
+            "error": reason
+        })
+        if (len(self._buffer) >= self.batch_size
+                or time.monotonic() - self._flushed_at >= self.flush_interval):
+            # Отмена рассылки не должна обрывать запись пакета на середине
+            await asyncio.shield(self.flush())
+
+    async def rollback(self) -> None:
+        """Откат запроса, прерванного отменой, перед сохранением журнала"""
+        async with self._lock:
+            await self.session.rollback()
+            await self.session.refresh(self.broadcast)
+
+    async def flush(self) -> None:
+        """Сохранение накопленных результатов и курсора одной транзакцией"""
+        async with self._lock:
+            # Курсор считаем до первого await, чтобы он не обогнал записанные строки
+            rows, self._buffer = self._buffer, []
+            if self._in_flight:
+                cursor = min(self._in_flight) - 1
+            else:
+                cursor = self._last_streamed
+            self._flushed_at = time.monotonic()
+            
+            sent = 0
+            dead_users = []
+            for row in rows:
+                if row["status"] == "sent":
+                    sent += 1
+                    continue
+                self._failure_reasons[row["error"]] = self._failure_reasons.get(row["error"], 0) + 1
+                if row["error"] in DEAD_CHAT_REASONS:
+                    dead_users.append(row["user_id"])
+            
+            if rows:
+                await self.session.execute(
+                    sqlite_insert(BroadcastDelivery).on_conflict_do_nothing(),
+                    rows
+                )
+            # Заблокировавших бота пользователей исключаем из будущих рассылок
+            if dead_users:
+                await self.session.execute(
+                    update(User).where(User.id.in_(dead_users)).values(is_active=False)
+                )
+            await self.session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == self.broadcast.id)
+                .values(
+                    sent_count=Broadcast.sent_count + sent,
+                    failed_count=Broadcast.failed_count + len(rows) - sent,
+                    failure_reasons=dict(self._failure_reasons),
+                    last_user_id=cursor
+                )
+            )
+            await self.session.commit()
+
+async def run_broadcast(
+    session: AsyncSession,
+    broadcast: Broadcast,
+    send: SendFunc,
+    control: Optional[BroadcastControl] = None,
+    broadcaster: Optional[Broadcaster] = None
+) -> dict:
+    """Отправка рассылки с журналом доставки и возможностью возобновления
+
+    При отмене задачи журнал сохраняется. Если рассылку отменил администратор
+    (control.cancelled), она завершается со статусом cancelled, иначе
+    (остановка бота) остается незавершенной и ее можно возобновить.
+    Если исходное сообщение недоступно, рассылка завершается со статусом
+    failed и BroadcastAborted передается дальше. Без broadcaster рассылка
+    идет с собственными ограничителями по BROADCAST_RATE.
+    """
+    if broadcaster is None:
+        broadcaster = create_broadcaster()
+    # ID запоминаем заранее: после прерванного запроса объект нельзя подгрузить
+    broadcast_id = broadcast.id
+    active_key = _active_key(session, broadcast_id)
+    if active_key in _active_broadcasts:
+        raise RuntimeError(f"Рассылка {broadcast_id} уже выполняется")
+    _active_broadcasts.add(active_key)
+    try:
+        ledger = DeliveryLedger(session, broadcast)
+        # Оценка числа оставшихся получателей для метрик (скорость и ETA)
+        expected = await session.scalar(
+            select(func.count())
+            .select_from(User)
+            .where(
+                User.is_active == True,
+                User.id > broadcast.last_user_id,
+                *segment_conditions(broadcast.segment)
+            )
+        )
         try:
-            if message.text:
-                await bot.send_message(chat_id, message.text)
-            elif message.photo:
-                await bot.send_photo(chat_id, message.photo[-1].file_id, caption=message.caption)
-            elif message.video:
-                await bot.send_video(chat_id, message.video.file_id)
-            elif message.document:
-                await bot.send_document(chat_id, message.document.file_id)
-            return True
-        except Exception as e:
-            if attempt == max_retries - 1:
-                return False
-            await asyncio.sleep(1)
-    return False
+            await broadcaster.run(
+                ledger.recipients(),
+                send,
+                ledger.record,
+                expected=expected,
+                label=str(broadcast_id),
+                control=control,
+                rate=delivery_rate(broadcast, expected)
+            )
+        except asyncio.CancelledError:
+            await ledger.rollback()
+            await ledger.flush()
+            if control and control.cancelled:
+                await _finish_broadcast(session, broadcast, "cancelled")
+            raise
+        except BroadcastAborted:
+            await ledger.rollback()
+            await ledger.flush()
+            await _finish_broadcast(session, broadcast, "failed")
+            raise
+        await ledger.flush()
+        await _finish_broadcast(session, broadcast, "completed")
+    finally:
+        _active_broadcasts.discard(active_key)
+    
+    return {
+        "total": broadcast.sent_count + broadcast.failed_count,
+        "sent": broadcast.sent_count,
+        "failed": broadcast.failed_count
+    }
+
+def delivery_rate(broadcast: Broadcast, remaining: int, now: Optional[datetime] = None) -> Optional[float]:
+    """Собственный лимит скорости рассылки: не выше max_rate и равномерно до конца окна
+
+    Считается при каждом запуске, поэтому продолженная рассылка растягивается
+    на оставшуюся часть окна. После конца окна действует только max_rate.
+    """
+    rate = broadcast.max_rate
+    if broadcast.deliver_until and remaining:
+        seconds = (broadcast.deliver_until - (now or datetime.utcnow())).total_seconds()
+        if seconds > 0:
+            rate = min(rate, remaining / seconds) if rate else remaining / seconds
+    return rate
+
+async def _finish_broadcast(session: AsyncSession, broadcast: Broadcast, status: str) -> None:
+    """Завершение рассылки; в дневную сводку попадают только выполненные до конца"""
+    await session.refresh(broadcast)
+    broadcast.status = status
+    broadcast.completed_at = datetime.utcnow()
+    if status == "completed":
+        await _add_to_daily_stats(session, broadcast)
+    await session.commit()
+
+async def create_broadcast(
+    session: AsyncSession,
+    message: Message,
+    album: Optional[List[Message]] = None,
+    segment: Optional[dict] = None,
+    schedule: Optional[dict] = None
+) -> Broadcast:
+    """Создание записи о рассылке сообщения (или альбома) администратора сегменту
+
+    schedule - время запуска, окно доставки и лимит скорости (см. scheduler.py);
+    рассылка с будущим временем запуска создается в статусе scheduled.
+    """
+    schedule = schedule or {}
+    now = datetime.utcnow()
+    scheduled_at = datetime.fromisoformat(schedule["start_at"]) if "start_at" in schedule else None
+    deliver_until = None
+    if "window" in schedule:
+        deliver_until = max(scheduled_at or now, now) + timedelta(seconds=schedule["window"])
+    broadcast = Broadcast(
+        message_text=message.text or message.caption or "Медиа-сообщение",
+        source_chat_id=message.chat.id,
+        source_message_id=message.message_id,
+        source_message_ids=message_ids(message, album) if album else None,
+        segment=segment,
+        scheduled_at=scheduled_at,
+        deliver_until=deliver_until,
+        max_rate=schedule.get("max_rate"),
+        status="scheduled" if scheduled_at and scheduled_at > now else "running",
+        last_user_id=0,
+        sent_count=0,
+        failed_count=0,
+        failure_reasons={}
+    )
+    session.add(broadcast)
+    await session.commit()
+    return broadcast
 
 async def broadcast_message(
     bot: Bot,
     message: Message,
-    session: Session
+    session: AsyncSession,
+    album: Optional[List[Message]] = None,
+    segment: Optional[dict] = None
 ) -> dict:
     """Выполнение массовой рассылки"""
-    users = session.query(User).filter(User.is_active == True).all()
-    total = len(users)
-    sent = 0
-    failed = 0
-    
-    # Создаем запись о рассылке
-    broadcast = Broadcast(message_text=message.text or "Медиа-сообщение")
-    session.add(broadcast)
-    session.commit()
-    
-    for user in users:
-        success = await send_message_with_retry(bot, user.user_id, message)
-        if success:
-            sent += 1
-        else:
-            failed += 1
-        await asyncio.sleep(0.05)  # Задержка между отправками
-    
-    # Обновляем статистику
-    broadcast.sent_count = sent
-    broadcast.failed_count = failed
-    broadcast.completed_at = datetime.utcnow()
-    session.commit()
-    
+    broadcast = await create_broadcast(session, message, album, segment)
+    return await run_broadcast(session, broadcast, copy_sender(bot, broadcast))
+
+def copy_sender(bot: Bot, broadcast: Broadcast) -> SendFunc:
+    """Отправка копии исходного сообщения (или альбома) рассылки из чата администратора"""
+    return copy_messages_sender(
+        bot,
+        broadcast.source_chat_id,
+        broadcast.source_message_ids or [broadcast.source_message_id]
+    )
+
+async def get_resumable_broadcast(session: AsyncSession, broadcast_id: int) -> Optional[Broadcast]:
+    """Незавершенная рассылка, которую можно продолжить"""
+    broadcast = await session.get(Broadcast, broadcast_id)
+    if not broadcast or broadcast.status not in ("running", "paused"):
+        return None
+    if _active_key(session, broadcast.id) in _active_broadcasts or not broadcast.source_chat_id:
+        return None
+    return broadcast
+
+async def resume_broadcast(bot: Bot, session: AsyncSession, broadcast_id: int) -> Optional[dict]:
+    """Продолжение прерванной рассылки с места остановки"""
+    broadcast = await get_resumable_broadcast(session, broadcast_id)
+    if not broadcast:
+        return None
+    return await run_broadcast(session, broadcast, copy_sender(bot, broadcast))
+
+async def set_broadcast_status(session: AsyncSession, broadcast_id: int, status: str) -> None:
+    """Смена статуса незавершенной рассылки (пауза, продолжение, отмена до запуска)"""
+    values = {"status": status}
+    # Без времени завершения рассылку не перенесет в архив retention.py
+    if status in FINISHED_BROADCAST_STATUSES:
+        values["completed_at"] = datetime.utcnow()
+    await session.execute(
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id, Broadcast.status.in_(("running", "paused")))
+        .values(**values)
+    )
+    await session.commit()
+
+async def get_scheduled_broadcasts(session: AsyncSession, due_before: Optional[datetime] = None) -> List[Broadcast]:
+    """Отложенные рассылки по времени запуска; due_before - только те, которым пора начаться"""
+    query = select(Broadcast).where(Broadcast.status == "scheduled")
+    if due_before is not None:
+        query = query.where(Broadcast.scheduled_at <= due_before)
+    result = await session.execute(query.order_by(Broadcast.scheduled_at))
+    return result.scalars().all()
+
+async def start_scheduled_broadcast(session: AsyncSession, broadcast_id: int) -> bool:
+    """Перевод отложенной рассылки в выполнение; False - ее уже запустили или отменили"""
+    result = await session.execute(
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id, Broadcast.status == "scheduled")
+        .values(status="running")
+    )
+    await session.commit()
+    return result.rowcount > 0
+
+async def cancel_scheduled_broadcast(session: AsyncSession, broadcast_id: int) -> bool:
+    """Отмена еще не начатой рассылки"""
+    result = await session.execute(
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id, Broadcast.status == "scheduled")
+        .values(status="cancelled", completed_at=datetime.utcnow())
+    )
+    await session.commit()
+    return result.rowcount > 0
+
+async def get_interrupted_broadcasts(session: AsyncSession) -> List[Broadcast]:
+    """Получение рассылок, прерванных перезапуском бота"""
+    result = await session.execute(
+        select(Broadcast)
+        .where(Broadcast.status.in_(("running", "paused")))
+        .order_by(Broadcast.id)
+    )
+    return [b for b in result.scalars().all() if _active_key(session, b.id) not in _active_broadcasts]
+
+async def _add_to_daily_stats(session: AsyncSession, broadcast: Broadcast) -> None:
+    """Добавление завершенной рассылки в дневную сводку"""
+    # Отложенная рассылка учитывается с момента запуска, а не создания
+    started = max(broadcast.created_at, broadcast.scheduled_at or broadcast.created_at)
+    duration = (broadcast.completed_at - started).total_seconds()
+    values = {
+        "day": started.date(),
+        "broadcasts": 1,
+        "sent": broadcast.sent_count,
+        "failed": broadcast.failed_count,
+        "duration_seconds": duration
+    }
+    stmt = sqlite_insert(BroadcastDailyStats).values(**values)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[BroadcastDailyStats.day],
+            set_={
+                "broadcasts": BroadcastDailyStats.broadcasts + 1,
+                "sent": BroadcastDailyStats.sent + stmt.excluded.sent,
+                "failed": BroadcastDailyStats.failed + stmt.excluded.failed,
+                "duration_seconds": BroadcastDailyStats.duration_seconds + stmt.excluded.duration_seconds
+            }
+        )
+    )
+
+def format_duration(seconds: float) -> str:
+    """Форматирование длительности в виде '1 ч 2 мин 3 с'"""
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    if minutes:
+        return f"{minutes} мин {seconds} с"
+    return f"{seconds} с"
+
+async def get_broadcast_summary(session: AsyncSession, days: int = config.STATS_WINDOW_DAYS) -> dict:
+    """Сводная статистика завершенных рассылок за период"""
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date()
+    result = await session.execute(
+        select(
+            func.coalesce(func.sum(BroadcastDailyStats.broadcasts), 0),
+            func.coalesce(func.sum(BroadcastDailyStats.sent), 0),
+            func.coalesce(func.sum(BroadcastDailyStats.failed), 0),
+            func.coalesce(func.sum(BroadcastDailyStats.duration_seconds), 0)
+        ).where(BroadcastDailyStats.day >= since)
+    )
+    broadcasts, sent, failed, duration = result.one()
+    total = sent + failed
     return {
-        "total": total,
+        "days": days,
+        "broadcasts": broadcasts,
         "sent": sent,
-        "failed": failed
+        "failed": failed,
+        "delivery_rate": sent / total * 100 if total else 0.0,
+        "avg_duration": duration / broadcasts if broadcasts else 0.0
     }
 
-def get_broadcast_stats(session: Session) -> List[dict]:
-    """Получение статистики рассылок"""
-    broadcasts = session.query(Broadcast).order_by(Broadcast.created_at.desc()).all()
+async def get_broadcast_stats(
+    session: AsyncSession,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None
+) -> List[dict]:
+    """Получение статистики рассылок
+
+    Рассылки идут от новых к старым; before_id и after_id задают
+    страницу старее или новее указанной рассылки.
+    """
+    query = select(Broadcast)
+    if after_id is not None:
+        query = query.where(Broadcast.id > after_id).order_by(Broadcast.id)
+    else:
+        if before_id is not None:
+            query = query.where(Broadcast.id < before_id)
+        query = query.order_by(Broadcast.id.desc())
+    if limit:
+        query = query.limit(limit)
+    result = await session.execute(query)
+    broadcasts = result.scalars().all()
+    if after_id is not None:
+        broadcasts = broadcasts[::-1]
     return [
         {
             "id": b.id,
             "message": b.message_text[:50] + "..." if len(b.message_text) > 50 else b.message_text,
             "sent": b.sent_count,
             "failed": b.failed_count,
+            "failure_reasons": b.failure_reasons or {},
+            "status": b.status,
             "created_at": b.created_at.strftime("%Y-%m-%d %H:%M:%S"),
             "completed_at": b.completed_at.strftime("%Y-%m-%d %H:%M:%S") if b.completed_at else None
         }
         for b in broadcasts
     ]
 
-def save_user_message(session: Session, user_id: int, message_text: str) -> UserMessage:
+async def get_or_create_user(
+    session: AsyncSession,
+    user_id: int,
+    username: Optional[str] = None,
+    first_name: Optional[str] = None,
+    last_name: Optional[str] = None
+) -> User:
+    """Получение пользователя или его создание при первом обращении"""
+    user = await get_user_by_id(session, user_id)
+    if user and not user.is_active:
+        # Пользователь снова написал боту - значит, он его разблокировал
+        user.is_active = True
+        await session.commit()
+    if not user:
+        user = User(
+            user_id=user_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name,
+            last_seen=datetime.utcnow()
+        )
+        session.add(user)
+        await session.commit()
+    return user
+
+async def _get_open_thread_id(session: AsyncSession, user_pk: int) -> Optional[int]:
+    """Диалог пользователя, который продолжает новое сообщение"""
+    result = await session.execute(
+        select(UserMessage.thread_id, UserMessage.created_at)
+        .where(UserMessage.user_id == user_pk)
+        .order_by(UserMessage.id.desc())
+        .limit(1)
+    )
+    last = result.first()
+    if not last or last.thread_id is None:
+        return None
+    if datetime.utcnow() - last.created_at > timedelta(hours=config.DIALOG_TIMEOUT_HOURS):
+        return None
+    return last.thread_id
+
+async def save_user_message(session: AsyncSession, user_id: int, message_text: str) -> UserMessage:
     """Сохранение сообщения пользователя"""
-    user = session.query(User).filter(User.user_id == user_id).first()
+    user = await get_user_by_id(session, user_id)
     if user:
+        user.is_active = True
+        user.last_seen = datetime.utcnow()
         message = UserMessage(
             user_id=user.id,
+            thread_id=await _get_open_thread_id(session, user.id),
             message_text=message_text
         )
         session.add(message)
-        session.commit()
+        if message.thread_id is None:
+            # Новый диалог: его ID совпадает с ID первого сообщения
+            await session.flush()
+            message.thread_id = message.id
+        await session.commit()
         return message
     return None
 
-def get_unread_messages(session: Session) -> List[dict]:
-    """Получение непрочитанных сообщений"""
-    messages = session.query(UserMessage).filter(UserMessage.is_read == False).all()
+async def upsert_users(session: AsyncSession, users: List[dict]) -> None:
+    """Пакетное добавление пользователей в транзакции вызывающего кода
+
+    Уже известные пользователи снова становятся активными, как в get_or_create_user.
+    """
+    if not users:
+        return
+    stmt = sqlite_insert(User).values(users)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[User.user_id],
+            set_={"is_active": True, "last_seen": stmt.excluded.last_seen}
+        )
+    )
+
+async def touch_users(session: AsyncSession, user_pks: List[int], seen_at: datetime) -> None:
+    """Обновление времени активности пользователей (users.id) одним запросом"""
+    if not user_pks:
+        return
+    await session.execute(
+        update(User).where(User.id.in_(set(user_pks))).values(last_seen=seen_at)
+    )
+
+async def get_user_pks(session: AsyncSession, user_ids: List[int]) -> Dict[int, int]:
+    """Соответствие Telegram ID пользователей их users.id одним запросом"""
+    if not user_ids:
+        return {}
+    result = await session.execute(
+        select(User.user_id, User.id).where(User.user_id.in_(set(user_ids)))
+    )
+    return dict(result.all())
+
+async def save_user_messages(session: AsyncSession, messages: List[Tuple[int, str]]) -> List[UserMessage]:
+    """Пакетное сохранение сообщений (users.id, текст) в транзакции вызывающего кода"""
+    if not messages:
+        return []
+    user_pks = {user_pk for user_pk, _ in messages}
+    # Последние сообщения всех авторов пакета - одним запросом
+    last_ids = (
+        select(func.max(UserMessage.id))
+        .where(UserMessage.user_id.in_(user_pks))
+        .group_by(UserMessage.user_id)
+    )
+    result = await session.execute(
+        select(UserMessage.user_id, UserMessage.thread_id, UserMessage.created_at)
+        .where(UserMessage.id.in_(last_ids))
+    )
+    opened_after = datetime.utcnow() - timedelta(hours=config.DIALOG_TIMEOUT_HOURS)
+    threads = {
+        row.user_id: row.thread_id
+        for row in result
+        if row.thread_id is not None and row.created_at >= opened_after
+    }
+    await session.execute(
+        update(User)
+        .where(User.id.in_(user_pks), User.is_active == False)
+        .values(is_active=True)
+    )
+    
+    saved = [
+        UserMessage(user_id=user_pk, thread_id=threads.get(user_pk), message_text=text)
+        for user_pk, text in messages
+    ]
+    session.add_all(saved)
+    await session.flush()
+    for message in saved:
+        if message.thread_id is None:
+            # Новый диалог: его ID совпадает с ID первого сообщения,
+            # следующие сообщения автора из этого же пакета продолжают его
+            message.thread_id = threads.setdefault(message.user_id, message.id)
+    await session.flush()
+    return saved
+
+async def save_admin_reply(session: AsyncSession, message_id: int, message_text: str) -> Optional[UserMessage]:
+    """Сохранение ответа администратора в диалоге пользователя"""
+    parent = await session.get(UserMessage, message_id)
+    if not parent:
+        return None
+    
+    reply = UserMessage(
+        user_id=parent.user_id,
+        parent_id=parent.id,
+        thread_id=parent.thread_id or parent.id,
+        message_text=message_text,
+        is_admin=True,
+        is_read=True
+    )
+    parent.is_read = True
+    session.add(reply)
+    await session.commit()
+    return reply
+
+async def get_user_message(session: AsyncSession, message_id: int) -> Optional[UserMessage]:
+    """Получение сообщения пользователя вместе с автором"""
+    return await session.get(UserMessage, message_id, options=[joinedload(UserMessage.user)])
+
+async def delete_user_message(session: AsyncSession, message_id: int) -> bool:
+    """Удаление одного сообщения пользователя"""
+    result = await session.execute(delete(UserMessage).where(UserMessage.id == message_id))
+    await session.commit()
+    return result.rowcount > 0
+
+async def get_unread_messages(
+    session: AsyncSession,
+    after_id: int = 0,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = None
+) -> List[dict]:
+    """Получение непрочитанных сообщений
+
+    Постраничная выборка по индексу (is_read, id): страница после after_id
+    или, если задан before_id, страница перед ним.
+    """
+    query = (
+        select(UserMessage)
+        .options(joinedload(UserMessage.user))
+        .where(UserMessage.is_read == False)
+    )
+    if before_id is not None:
+        query = query.where(UserMessage.id < before_id).order_by(UserMessage.id.desc())
+    else:
+        query = query.where(UserMessage.id > after_id).order_by(UserMessage.id)
+    if limit:
+        query = query.limit(limit)
+    result = await session.execute(query)
+    messages = result.scalars().all()
+    if before_id is not None:
+        messages = messages[::-1]
     return [
         {
             "id": m.id,
@@ -107,26 +693,97 @@ def get_unread_messages(session: Session) -> List[dict]:
         for m in messages
     ]
 
-def get_dialog(session: Session, message_id: int) -> List[dict]:
-    """Получение диалога по ID сообщения"""
-    message = session.query(UserMessage).filter(UserMessage.id == message_id).first()
-    if not message:
+def _fts_query(query: str) -> Optional[str]:
+    """Запрос FTS5 из текста администратора: все слова, каждое как префикс
+
+    Слова берутся в кавычки, поэтому операторы FTS5 и спецсимволы
+    во вводе не ломают запрос.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+async def search_messages(
+    session: AsyncSession,
+    query: str,
+    offset: int = 0,
+    limit: int = 10
+) -> Optional[List[dict]]:
+    """Поиск сообщений пользователей по индексу FTS5, лучшие совпадения первыми
+
+    Возвращает None, если поиск недоступен (SQLite без FTS5).
+    """
+    match = _fts_query(query)
+    if match is None:
         return []
-    
-    # Получаем корневое сообщение
-    root = message
-    while root.parent_id:
-        root = session.query(UserMessage).filter(UserMessage.id == root.parent_id).first()
-    
-    # Получаем все сообщения диалога
-    messages = session.query(UserMessage).filter(
-        (UserMessage.id == root.id) | 
-        (UserMessage.parent_id == root.id)
-    ).order_by(UserMessage.created_at).all()
+    fts = literal_column("user_messages_fts")
+    stmt = (
+        select(
+            UserMessage.id,
+            UserMessage.created_at,
+            User.user_id,
+            User.username,
+            func.snippet(fts, 0, "«", "»", "…", 16).label("snippet")
+        )
+        .select_from(user_messages_fts)
+        .join(UserMessage, UserMessage.id == user_messages_fts.c.rowid)
+        .join(User, User.id == UserMessage.user_id)
+        .where(text("user_messages_fts MATCH :match").bindparams(match=match))
+        .order_by(literal_column("rank"))
+        .offset(offset)
+        .limit(limit)
+    )
+    try:
+        result = await session.execute(stmt)
+    except OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        await session.rollback()
+        return None
+    return [
+        {
+            "id": row.id,
+            "user_id": row.user_id,
+            "username": row.username or "Без username",
+            "message": row.snippet,
+            "created_at": row.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        for row in result.all()
+    ]
+
+def _thread_of(message_id: int):
+    """Подзапрос: ID диалога, к которому относится сообщение"""
+    return (
+        select(UserMessage.thread_id)
+        .where(UserMessage.id == message_id)
+        .scalar_subquery()
+    )
+
+async def get_dialog(
+    session: AsyncSession,
+    message_id: int,
+    after_id: int = 0,
+    limit: Optional[int] = None
+) -> List[dict]:
+    """Получение диалога по ID сообщения"""
+    # Один запрос: диалог по индексу (thread_id, id) вместе с пользователем
+    query = (
+        select(UserMessage)
+        .options(joinedload(UserMessage.user))
+        .where(UserMessage.thread_id == _thread_of(message_id), UserMessage.id > after_id)
+        .order_by(UserMessage.id)
+    )
+    if limit:
+        query = query.limit(limit)
+    result = await session.execute(query)
+    messages = result.scalars().all()
     
     return [
         {
             "id": m.id,
+            "thread_id": m.thread_id,
+            "parent_id": m.parent_id,
             "user_id": m.user.user_id,
             "username": m.user.username or "Без username",
             "message": m.message_text,
@@ -136,41 +793,110 @@ def get_dialog(session: Session, message_id: int) -> List[dict]:
         for m in messages
     ]
 
-def delete_dialog(session: Session, message_id: int) -> bool:
+async def delete_dialog(session: AsyncSession, message_id: int) -> bool:
     """Удаление диалога по ID сообщения"""
-    message = session.query(UserMessage).filter(UserMessage.id == message_id).first()
-    if not message:
-        return False
-    
-    # Получаем корневое сообщение
-    root = message
-    while root.parent_id:
-        root = session.query(UserMessage).filter(UserMessage.id == root.parent_id).first()
-    
-    # Удаляем все сообщения диалога
-    session.query(UserMessage).filter(
-        (UserMessage.id == root.id) | 
-        (UserMessage.parent_id == root.id)
-    ).delete()
-    session.commit()
-    return True
-
-def mark_message_as_read(session: Session, message_id: int) -> None:
+    # Подзапрос вычисляется до удаления строк, поэтому хватает одного DELETE
+    result = await session.execute(
+        delete(UserMessage).where(UserMessage.thread_id == _thread_of(message_id))
+    )
+    await session.commit()
+    return result.rowcount > 0
+
+async def mark_message_as_read(session: AsyncSession, message_id: int) -> None:
     """Отметить сообщение как прочитанное"""
-    message = session.query(UserMessage).filter(UserMessage.id == message_id).first()
-    if message:
-        message.is_read = True
-        session.commit()
+    await session.execute(
+        update(UserMessage).where(UserMessage.id == message_id).values(is_read=True)
+    )
+    await session.commit()
 
-def get_user_by_id(session: Session, user_id: int) -> User:
+async def mark_messages_as_read(session: AsyncSession, first_id: int, last_id: int) -> int:
+    """Отметить прочитанными непрочитанные сообщения из диапазона ID"""
+    result = await session.execute(
+        update(UserMessage)
+        .where(
+            UserMessage.is_read == False,
+            UserMessage.id >= first_id,
+            UserMessage.id <= last_id
+        )
+        .values(is_read=True)
+    )
+    await session.commit()
+    return result.rowcount
+
+async def get_user_by_id(session: AsyncSession, user_id: int) -> Optional[User]:
     """Получение пользователя по ID"""
-    return session.query(User).filter(User.user_id == user_id).first()
+    result = await session.execute(select(User).where(User.user_id == user_id))
+    return result.scalars().first()
+
+async def clear_broadcast_stats(session: AsyncSession) -> bool:
+    """Очистка статистики рассылок
 
-def clear_broadcast_stats(session: Session) -> bool:
-    """Очистка статистики рассылок"""
+    Удаляются только завершенные рассылки: выполняющиеся, приостановленные
+    и запланированные остаются вместе с журналом доставки.
+    """
+    finished = select(Broadcast.id).where(Broadcast.status.in_(FINISHED_BROADCAST_STATUSES))
     try:
-        session.query(Broadcast).delete()
-        session.commit()
+        await session.execute(delete(BroadcastDelivery).where(BroadcastDelivery.broadcast_id.in_(finished)))
+        await session.execute(delete(Broadcast).where(Broadcast.status.in_(FINISHED_BROADCAST_STATUSES)))
+        await session.execute(delete(BroadcastDailyStats))
+        await session.commit()
         return True
-    except:
-        return False 
\ No newline at end of file
+    except SQLAlchemyError:
+        await session.rollback()
+        return False
+
+async def get_archivable_messages(session: AsyncSession, before: datetime, limit: int) -> List[dict]:
+    """Прочитанные сообщения старше before - записи для архива, самые старые первыми"""
+    result = await session.execute(
+        select(
+            UserMessage.id,
+            User.user_id,
+            User.username,
+            UserMessage.parent_id,
+            UserMessage.thread_id,
+            UserMessage.message_text,
+            UserMessage.is_admin,
+            UserMessage.created_at
+        )
+        .outerjoin(User, User.id == UserMessage.user_id)
+        .where(UserMessage.created_at < before, UserMessage.is_read == True)
+        .order_by(UserMessage.created_at)
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in result]
+
+async def delete_user_messages(session: AsyncSession, message_ids: List[int]) -> int:
+    """Удаление пакета сообщений (вместе с их записями в индексе поиска)"""
+    result = await session.execute(delete(UserMessage).where(UserMessage.id.in_(message_ids)))
+    await session.commit()
+    return result.rowcount
+
+async def get_archivable_broadcasts(session: AsyncSession, before: datetime, limit: int) -> List[Broadcast]:
+    """Рассылки, завершенные или отмененные раньше before"""
+    result = await session.execute(
+        select(Broadcast)
+        .where(Broadcast.status.in_(FINISHED_BROADCAST_STATUSES), Broadcast.completed_at < before)
+        .order_by(Broadcast.id)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+async def purge_broadcast_deliveries(session: AsyncSession, broadcast_id: int, limit: int) -> int:
+    """Удаление части журнала доставки рассылки; возвращает число удаленных записей"""
+    batch = (
+        select(BroadcastDelivery.user_id)
+        .where(BroadcastDelivery.broadcast_id == broadcast_id)
+        .limit(limit)
+    )
+    result = await session.execute(
+        delete(BroadcastDelivery)
+        .where(BroadcastDelivery.broadcast_id == broadcast_id, BroadcastDelivery.user_id.in_(batch))
+    )
+    await session.commit()
+    return result.rowcount
+
+async def delete_broadcasts(session: AsyncSession, broadcast_ids: List[int]) -> int:
+    """Удаление рассылок; дневная сводка /stats при этом сохраняется"""
+    result = await session.execute(delete(Broadcast).where(Broadcast.id.in_(broadcast_ids)))
+    await session.commit()
+    return result.rowcount
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import signal
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+import config
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука с ограничением числа одновременно обрабатываемых обновлений
+
+    Telegram получает ответ сразу, а обновление обрабатывается в фоне.
+    Когда все слоты заняты, ответ задерживается - это естественное
+    противодавление для Telegram и балансировщика. Обработчики нескольких
+    ботов могут делить одни слоты (semaphore).
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        concurrency: int = config.WEBHOOK_CONCURRENCY,
+        shutdown_timeout: float = config.WEBHOOK_SHUTDOWN_TIMEOUT,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        **kwargs: Any
+    ):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self.shutdown_timeout = shutdown_timeout
+        self._semaphore = semaphore or asyncio.Semaphore(concurrency)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        except Exception as e:
+            logging.exception(f"Ошибка при обработке обновления: {e}")
+        finally:
+            self._semaphore.release()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        await self._semaphore.acquire()
+        try:
+            return await super()._handle_request_background(bot, request)
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    async def drain(self) -> None:
+        """Дождаться обработки принятых обновлений"""
+        tasks = list(self._background_feed_update_tasks)
+        if tasks:
+            logging.info(f"Ожидание обработки {len(tasks)} обновлений")
+            done, pending = await asyncio.wait(tasks, timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+
+    async def close(self) -> None:
+        """Дождаться обработки принятых обновлений и закрыть сессию бота"""
+        await self.drain()
+        await super().close()
+
+
+def webhook_path(name: str = "") -> str:
+    """Путь вебхука бота: у ботов из BOTS_FILE - с именем бота"""
+    return f"{config.WEBHOOK_PATH.rstrip('/')}/{name}" if name else config.WEBHOOK_PATH
+
+
+def create_webhook_app(
+    dispatcher: Dispatcher,
+    bots: Dict[str, Bot],
+    concurrency: int = config.WEBHOOK_CONCURRENCY,
+    **kwargs: Any
+) -> web.Application:
+    """Создание aiohttp-приложения для приема обновлений
+
+    bots - боты процесса по именам (см. webhook_path); ограничение
+    одновременно обрабатываемых обновлений общее для всех ботов.
+    """
+    app = web.Application()
+    semaphore = asyncio.Semaphore(concurrency)
+    handlers = []
+    for name, bot in bots.items():
+        handler = BoundedRequestHandler(
+            dispatcher,
+            bot,
+            semaphore=semaphore,
+            secret_token=config.WEBHOOK_SECRET or None,
+            **kwargs
+        )
+        app.router.add_route("POST", webhook_path(name), handler.handle)
+        handlers.append(handler)
+
+    async def drain_handlers(app: web.Application) -> None:
+        await asyncio.gather(*(handler.drain() for handler in handlers))
+
+    async def close_sessions(app: web.Application) -> None:
+        for handler in handlers:
+            await handler.close()
+
+    # Остановка идет по порядку: сначала дождаться принятых обновлений всех
+    # ботов, затем остановить диспетчер (фоновые задачи ботов при остановке
+    # еще обращаются к Bot API) и только потом закрыть общую HTTP-сессию
+    app.on_shutdown.append(drain_handlers)
+    setup_application(app, dispatcher, bots=list(bots.values()))
+    app.on_shutdown.append(close_sessions)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bots: Dict[str, Bot]) -> None:
+    """Запуск ботов в режиме вебхука до получения SIGINT/SIGTERM"""
+    app = create_webhook_app(dispatcher, bots)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+
+    for name, bot in bots.items():
+        if config.WEBHOOK_URL:
+            await bot.set_webhook(
+                config.WEBHOOK_URL.rstrip("/") + webhook_path(name),
+                secret_token=config.WEBHOOK_SECRET or None,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=dispatcher.resolve_used_update_types()
+            )
+        logging.info(f"Вебхук слушает {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{webhook_path(name)}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Остановка вебхука")
+        await runner.cleanup()
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import config
+from utils import get_user_pks, save_user_messages, touch_users, upsert_users
+
+
+class WriteBehindBuffer:
+    """Отложенная пакетная запись входящих сообщений и регистраций пользователей
+
+    Обработчики только добавляют записи в буфер. Буфер сбрасывается в базу
+    одной транзакцией при накоплении batch_size записей, раз в interval секунд
+    и при остановке бота. Соответствие Telegram ID и users.id кэшируется,
+    поэтому поиск пользователя не выполняется для каждого сообщения.
+
+    Если база недоступна, записи остаются в буфере, а следующая попытка
+    откладывается с удвоением паузы до max_backoff секунд. Сверх max_pending
+    записей новые записи отбрасываются (их число пишется в журнал).
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        batch_size: int = config.WRITE_BEHIND_BATCH_SIZE,
+        interval: float = config.WRITE_BEHIND_INTERVAL,
+        cache_size: int = config.USER_CACHE_SIZE,
+        max_pending: int = config.WRITE_BEHIND_MAX_PENDING,
+        max_backoff: float = config.WRITE_BEHIND_MAX_BACKOFF
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.cache_size = cache_size
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        # Регистрации по Telegram ID: повторный /start до сброса не дублируется
+        self._users: Dict[int, dict] = {}
+        # Сообщения (Telegram ID, текст) в порядке получения
+        self._messages: List[Tuple[int, str]] = []
+        self._user_pks = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # Неудачные сбросы подряд и время следующей попытки (time.monotonic)
+        self._failures = 0
+        self._retry_at = 0.0
+        # Отброшено из-за переполнения с последней записи в журнал
+        self._dropped = 0
+
+    @property
+    def pending(self) -> int:
+        """Количество записей, ожидающих сброса"""
+        return len(self._users) + len(self._messages)
+
+    async def add_user(
+        self,
+        user_id: int,
+        username: Optional[str] = None,
+        first_name: Optional[str] = None,
+        last_name: Optional[str] = None
+    ) -> None:
+        """Регистрация пользователя (аналог get_or_create_user)"""
+        if user_id not in self._users and self.pending >= self.max_pending:
+            self._dropped += 1
+            return
+        self._users[user_id] = {
+            "user_id": user_id,
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            "last_seen": datetime.utcnow()
+        }
+        await self._flush_if_full()
+
+    async def add_message(self, user_id: int, message_text: str) -> None:
+        """Сообщение пользователя (аналог save_user_message)"""
+        if self.pending >= self.max_pending:
+            self._dropped += 1
+            return
+        self._messages.append((user_id, message_text))
+        await self._flush_if_full()
+
+    def _backing_off(self) -> bool:
+        return time.monotonic() < self._retry_at
+
+    async def _flush_if_full(self) -> None:
+        # Заполненный буфер сбрасывается сразу: обработчик ждет записи,
+        # и это ограничивает рост буфера при пиковой нагрузке.
+        # После ошибки базы обработчики не ждут ее до конца паузы
+        if self.pending >= self.batch_size and not self._backing_off():
+            await self.flush()
+
+    def _get_cached(self, user_id: int) -> Optional[int]:
+        user_pk = self._user_pks.get(user_id)
+        if user_pk is not None:
+            self._user_pks.move_to_end(user_id)
+        return user_pk
+
+    def _cache(self, user_pks: Dict[int, int]) -> None:
+        for user_id, user_pk in user_pks.items():
+            self._user_pks[user_id] = user_pk
+            self._user_pks.move_to_end(user_id)
+        while len(self._user_pks) > self.cache_size:
+            self._user_pks.popitem(last=False)
+
+    async def flush(self) -> int:
+        """Запись накопленного буфера одной транзакцией; возвращает число записей"""
+        async with self._lock:
+            if self._dropped:
+                logging.error(f"Буфер записи переполнен: отброшено {self._dropped} входящих записей")
+                self._dropped = 0
+            users, messages = self._users, self._messages
+            if not users and not messages:
+                return 0
+            self._users, self._messages = {}, []
+
+            user_pks = {}
+            missing = []
+            for user_id, _ in messages:
+                user_pk = self._get_cached(user_id)
+                if user_pk is not None:
+                    user_pks[user_id] = user_pk
+                else:
+                    missing.append(user_id)
+
+            try:
+                async with self.session_factory() as session:
+                    # Регистрации раньше сообщений: сообщение после /start
+                    # из того же пакета найдет своего автора
+                    await upsert_users(session, list(users.values()))
+                    found = await get_user_pks(session, missing)
+                    user_pks.update(found)
+                    # Сообщения незарегистрированных пользователей не сохраняются
+                    saved = [
+                        (user_pks[user_id], text)
+                        for user_id, text in messages
+                        if user_id in user_pks
+                    ]
+                    await save_user_messages(session, saved)
+                    # Время активности авторов пакета - одним UPDATE в той же транзакции
+                    await touch_users(session, [user_pk for user_pk, _ in saved], datetime.utcnow())
+                    await session.commit()
+            except SQLAlchemyError as e:
+                self._failures += 1
+                backoff = min(self.interval * 2 ** (self._failures - 1), self.max_backoff)
+                self._retry_at = time.monotonic() + backoff
+                logging.error(
+                    f"Ошибка при записи буфера ({len(users) + len(messages)} записей), "
+                    f"следующая попытка через {backoff:.1f} с: {e}"
+                )
+                # Возвращаем записи в начало буфера для следующей попытки
+                users.update(self._users)
+                self._users = users
+                self._messages = messages + self._messages
+                # Пока шла запись, буфер мог снова заполниться: лишнее отбрасываем
+                overflow = min(self.pending - self.max_pending, len(self._messages))
+                if overflow > 0:
+                    del self._messages[-overflow:]
+                    self._dropped += overflow
+                return 0
+
+            self._failures = 0
+            self._retry_at = 0.0
+            self._cache(found)
+            return len(users) + len(messages)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._backing_off():
+                continue
+            try:
+                # shield: остановка не прерывает начатую транзакцию
+                await asyncio.shield(self.flush())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.exception(f"Ошибка фонового сброса буфера: {e}")
+
+    async def start(self) -> None:
+        """Запуск периодического сброса буфера"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Остановка периодического сброса и запись оставшихся данных"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self.pending:
+            logging.error(f"При остановке не записано {self.pending} входящих записей")